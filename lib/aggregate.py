@@ -0,0 +1,122 @@
+import threading
+import concurrent.futures
+import numpy
+import pandas
+
+from typing import Callable
+
+# Streaming aggregation of binned media logs
+# Each log is folded into running per-timestamp statistics (number of samples,
+# mean and sum of squared deviations, merged with Chan's parallel formula), so
+# every experiment of a rate contributes without the logs ever being
+# concatenated. The same logs are aggregated at every step at once, and the
+# aggregates remember the files they have folded, so a new experiment only
+# costs folding its own log.
+
+
+class Aggregate:
+
+    def __init__(self, columns: dict[str, tuple[str, bool]], key: str = "ts"):
+        # output column -> (source column, whether zeros are ignored)
+        self.columns = columns
+        self.key     = key
+        self.keys    = numpy.empty(0)
+        self.count   = numpy.empty((0, len(self.columns)))
+        self.mean    = numpy.empty((0, len(self.columns)))
+        self.m2      = numpy.empty((0, len(self.columns)))
+
+    def fold(self, frame: pandas.DataFrame):
+        # the log holds one row per bin, so every timestamp of the
+        # log is a sample of size one (or zero, if masked)
+        keys, first = numpy.unique(frame[self.key].to_numpy(dtype="float64"), return_index=True)
+        values = frame[[source for source, _ in self.columns.values()]].to_numpy(dtype="float64")[first]
+        ignore = numpy.array([zeros for _, zeros in self.columns.values()])
+
+        mask = ~numpy.isnan(values) & ~(ignore & (values == 0))
+
+        # unique keys come out sorted, as merge expects them
+        other = Aggregate(self.columns, self.key)
+        other.keys  = keys
+        other.count = mask.astype("float64")
+        other.mean  = numpy.where(mask, values, 0)
+        other.m2    = numpy.zeros_like(values)
+        self.merge(other)
+
+    def merge(self, other: "Aggregate"):
+        keys = numpy.union1d(self.keys, other.keys)
+        na, ma, qa = self.__align(keys)
+        nb, mb, qb = other.__align(keys)
+
+        count = na + nb
+        delta = mb - ma
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            weight = numpy.where(count > 0, nb / count, 0)
+
+        self.keys  = keys
+        self.count = count
+        self.mean  = ma + delta * weight
+        self.m2    = qa + qb + delta * delta * na * weight
+
+    def __align(self, keys: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        # statistics spread over a superset of the current keys
+        index  = numpy.searchsorted(keys, self.keys)
+        shape  = (len(keys), len(self.columns))
+        arrays = []
+        for array in (self.count, self.mean, self.m2):
+            spread = numpy.zeros(shape)
+            spread[index] = array
+            arrays.append(spread)
+        return tuple(arrays)
+
+    def frame(self) -> pandas.DataFrame:
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            mean = numpy.where(self.count > 0, self.mean, numpy.nan)
+            std  = numpy.sqrt(self.m2 / self.count)
+
+        data = pandas.DataFrame(mean, columns=list(self.columns))
+        for i, column in enumerate(self.columns):
+            data[f"{column}_std"] = std[:, i]
+        data.insert(0, self.key, self.keys)
+        return data
+
+
+class Aggregates:
+
+    def __init__(self, columns: dict[str, tuple[str, bool]], steps: list[str]):
+        # one aggregate of the same logs per step
+        self.columns = columns
+        self.steps   = steps
+        self.lock    = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.files      = {}
+        self.aggregates = {step: Aggregate(self.columns) for step in self.steps}
+
+    def __getitem__(self, step: str) -> Aggregate:
+        return self.aggregates[step]
+
+    def frame(self, step: str) -> pandas.DataFrame:
+        # a snapshot of one step, never taken while another session folds files in
+        with self.lock:
+            return self.aggregates[step].frame()
+
+    def merge(self, other: "Aggregates"):
+        for step in self.steps:
+            self.aggregates[step].merge(other.aggregates[step])
+
+    def update(self, signatures: dict[str, bytes],
+               summarize: Callable[[str], "Aggregates"], executor: concurrent.futures.Executor) -> int:
+        with self.lock:
+            # a folded file cannot be taken out again, start over if any
+            # of them was changed or deleted
+            if any(signatures.get(path) != signature for path, signature in self.files.items()):
+                self.reset()
+
+            paths = [path for path in signatures if path not in self.files]
+            for partial in executor.map(summarize, paths):
+                self.merge(partial)
+            for path in paths:
+                self.files[path] = signatures[path]
+        # number of files folded
+        return len(paths)
@@ -0,0 +1,505 @@
+import os
+import sys
+import json
+import time
+import decimal
+import argparse
+import warnings
+import tracemalloc
+import numpy
+import pandas
+import streamlit.config
+import streamlit.logger
+import plotly.graph_objects as go
+
+from typing import Callable
+
+from lib.generic import Protocol
+from lib.generic import Document
+
+from lib.generic import LOG_BOT_COMPLETE
+from lib.generic import LAYER4_COUNTERS
+from lib.generic import format_layer
+from lib.generic import timeline_figure
+from lib.generic import trend_figure
+from lib.generic import scatter_figure
+from lib.generic import fmt_volume
+from lib.generic import fmt_timestamp
+from lib.generic import fmt_flow_ids
+from lib.generic import split_volumes
+from lib.generic import split_timestamps
+from lib.generic import __level_of_detail
+from lib.generic import __extract_streaming_periods
+
+from lib.storage import SORTED
+from lib.storage import read_log
+from lib.storage import parse_log
+
+from lib.experiment import DOCUMENTS
+from lib.experiment import COLUMNS
+from lib.experiment import load_meta
+from lib.experiment import load_document
+
+from lib.binning import bin_experiment
+
+from lib.rollup import STEPS
+from lib.rollup import COUNTERS
+from lib.rollup import rollup
+
+from lib.aggregate import Aggregate
+
+from lib.join import link
+from lib.join import url_hosts
+
+from lib.periods import CLASSES
+from lib.periods import period_counts
+
+from lib.chunks import spread
+from lib.chunks import chunked
+from lib.chunks import REDUCERS
+
+from lib.dazn.__fst_section import layer4_frame
+from lib.dazn.__fst_section import layer4_titles
+
+from lib.dazn.__trd_section import load_samples
+from lib.dazn.__trd_section import media_aggregates
+
+# Benchmark suite
+# Runs the hot paths of the dashboard (log parsing and loading, formatting,
+# figure construction, media aggregation, binning and out-of-core
+# reductions) against real experiments of the bundled dataset, outside of
+# Streamlit. Every case reports its median wall time, the peak of traced
+# (Python and numpy) memory and the size of the serialized figure it builds.
+# Results are compared with the baselines in res/benchmark.json, and any
+# case beyond its tolerance fails the run. The results of the engines
+# (hover values, level of detail, binning, rollups, aggregates, join, period
+# bucketing and windowed reads) are checked too, against plain reference
+# implementations on the same inputs: any value which differs fails the run.
+# Baselines are machine dependent, record them again (--update) after
+# moving to another machine or after an intended change.
+#
+#   python -m lib.benchmark [--update] [--repeat N] [--filter TEXT]
+
+SERVER = "dazn"
+
+# experiments the per experiment cases run on
+EXPERIMENTS = [("1.5Mbps", "test-1"), ("50Mbps", "test-1")]
+
+BASELINE = os.path.join("res", "benchmark.json")
+
+# a case regresses when a metric exceeds its baseline times the factor plus the slack
+TOLERANCE = {"time": 1.5, "memory": 1.25, "size": 1.10}
+SLACK     = {"time": 0.005, "memory": 1 << 20, "size": 0}
+
+# media logs the rollups and aggregates are checked on
+MEDIA = 8
+
+# aggregated columns checked, one ignoring zeros and one not
+AGGREGATED = {"s_bytes_all": ("s_bytes_all", False), "video_rate": ("avg_video_rate", True)}
+
+# flow logs and the protocol they are formatted with
+LAYER4 = {
+    Document.LOG_TCP_COMPLETE: Protocol.TCP,
+    Document.LOG_TCP_PERIODIC: Protocol.TCP,
+    Document.LOG_UDP_COMPLETE: Protocol.UDP,
+    Document.LOG_UDP_PERIODIC: Protocol.UDP,
+}
+
+
+def experiment_cases(rate: str, test: str) -> dict[str, Callable[[], go.Figure | None]]:
+    root  = os.path.join(SERVER, rate, test)
+    name  = f"{rate}/{test}"
+    paths = {document: os.path.join(root, file) for document, (file, _) in DOCUMENTS.items()}
+
+    # inputs of the cases, prepared once
+    meta   = load_meta(os.path.join(root, LOG_BOT_COMPLETE))
+    raw    = {document: read_log(path, document) for document, path in paths.items()}
+    frames = {document: load_document(path, DOCUMENTS[document][1], document, COLUMNS.get(document))
+              for document, path in paths.items()}
+    window = (0, max(meta["rel"].max(), *(frames[document]["te"].max() for document in LAYER4)))
+
+    def parse():
+        for document, path in paths.items():
+            parse_log(path, document)
+
+    def load():
+        for document, path in paths.items():
+            load_document(path, DOCUMENTS[document][1], document, COLUMNS.get(document))
+        load_meta(os.path.join(root, LOG_BOT_COMPLETE))
+
+    def formatting(document: Document):
+        def run():
+            format_layer(data=raw[document].copy(), protocol=DOCUMENTS[document][1], document=document)
+        return run
+
+    def layer4(document: Document):
+        def run():
+            protocol = LAYER4[document]
+            data = frames[document]
+            data = layer4_frame(data=data, protocol=protocol, document=document,
+                                cnames=list(data["cname"].unique()), window=window)
+            return timeline_figure(data=data, meta=meta, xs="datetime_ts", xe="datetime_te", y="id",
+                                   color="cname", **layer4_titles(protocol=protocol, document=document),
+                                   hover=(protocol, document), window=window)
+        return run
+
+    def layer7():
+        hcom  = frames[Document.LOG_HAR_COMPLETE]
+        media = hcom[hcom["kind"].notna()]
+        return timeline_figure(data=media, meta=meta, xs="datetime_ts", xe="datetime_te", y="mime",
+                               color="mime", xaxis_title="time [mm:ss]", yaxis_title="mime",
+                               chart_title="HTTP transaction by MIME",
+                               hover=(Protocol.HTTP, Document.LOG_HAR_COMPLETE))
+
+    def binning():
+        bin_experiment(root, 3000)
+
+    def chunks(by: str):
+        def run():
+            for document in [Document.LOG_TCP_PERIODIC, Document.LOG_HAR_COMPLETE]:
+                chunked(paths[document], document, by=by, step=1000)
+        return run
+
+    cases = {f"{name}/parse": parse, f"{name}/load": load, f"{name}/bin_experiment": binning,
+             f"{name}/chunks/flow": chunks("flow"), f"{name}/chunks/bin": chunks("bin")}
+    for document in DOCUMENTS:
+        cases[f"{name}/format_layer/{document.name.lower()}"] = formatting(document)
+    for document in LAYER4:
+        cases[f"{name}/timeline/{document.name.lower()}"] = layer4(document)
+    cases[f"{name}/timeline/log_har_complete"] = layer7
+    return cases
+
+def media_cases() -> dict[str, Callable[[], go.Figure | None]]:
+
+    def samples(protocol: Protocol):
+        def run():
+            # aggregates are shared resources, start from scratch
+            media_aggregates.clear()
+            load_samples(step="5000", protocol=protocol)
+        return run
+
+    data = load_samples(step="5000", protocol=Protocol.TCP)
+
+    def trend():
+        return trend_figure(x="ts", y="s_bytes_all", xaxis_title="time [mm:ss]", yaxis_title="bytes [B]",
+                            chart_title="server bytes over time", samples=data)
+
+    def scatter():
+        return scatter_figure(x="s_bytes_all", y="video_rate", xaxis_title="bytes [B]", yaxis_title="rate [kbits]",
+                              chart_title="server bytes vs video rate", samples=data)
+
+    return {"media/load_samples/tcp": samples(Protocol.TCP),
+            "media/load_samples/udp": samples(Protocol.UDP),
+            "media/trend_figure":     trend,
+            "media/scatter_figure":   scatter}
+
+def fixed(value: float) -> str:
+    # plotly's .2f as the browser prints it (toFixed): exact value, ties away from zero
+    return str(decimal.Decimal(value).quantize(decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP))
+
+def hover_text(timestamps: pandas.Series, volumes: pandas.Series) -> tuple[int, int]:
+    # the text of the hover, as fmt_timestamp and fmt_volume wrote it
+    seconds, millis = split_timestamps(timestamps)
+    values, units   = split_volumes(volumes)
+    text = [f"{s:.2f}s {fixed(m)}ms" for s, m in zip(seconds, millis)]
+    differ  = sum(a != fmt_timestamp(value) for a, value in zip(text, timestamps))
+    text = [f"{fixed(v)} {u}" for v, u in zip(values, units)]
+    differ += sum(a != fmt_volume(value) for a, value in zip(text, volumes))
+    return len(timestamps) + len(volumes), differ
+
+def edge_checks() -> dict[str, Callable[[], tuple[int, int]]]:
+
+    def hover():
+        # milliseconds on every half hundredth and volumes on every eighth of a unit,
+        # where rounding twice and rounding ties differ
+        timestamps = pandas.Series(numpy.arange(0, 1000, 0.005) + 12000)
+        volumes    = pandas.Series(numpy.concatenate([numpy.arange(0, 1024, 0.125), numpy.arange(0, 1 << 20, 64)]))
+        return hover_text(timestamps, volumes)
+
+    return {"edges/check/hover": hover}
+
+def check_cases(rate: str, test: str) -> dict[str, Callable[[], tuple[int, int]]]:
+    # every check returns the number of values compared and of those which differ
+    root  = os.path.join(SERVER, rate, test)
+    name  = f"{rate}/{test}"
+    paths = {document: os.path.join(root, file) for document, (file, _) in DOCUMENTS.items()}
+
+    meta    = load_meta(os.path.join(root, LOG_BOT_COMPLETE))
+    frames  = {document: load_document(path, DOCUMENTS[document][1], document, COLUMNS.get(document))
+               for document, path in paths.items()}
+    periods = __extract_streaming_periods(frame=meta)
+
+    def hover():
+        checked = differ = 0
+        for document in [*LAYER4, Document.LOG_HAR_COMPLETE]:
+            data = frames[document]
+            columns = [column for column in ["c_bytes_all", "s_bytes_all", "size"] if column in data.columns]
+            result  = hover_text(pandas.concat([data["ts"], data["te"]]),
+                                 pandas.concat([data[column] for column in columns]).dropna())
+            checked += result[0]
+            differ  += result[1]
+        return checked, differ
+
+    def detail():
+        # merged bins keep the counters of their own flow, at any zoom and number of shapes
+        checked = differ = 0
+        for document, protocol in LAYER4.items():
+            if document not in (Document.LOG_TCP_PERIODIC, Document.LOG_UDP_PERIODIC):
+                continue
+            data = frames[document].assign(id=fmt_flow_ids(frames[document]))
+            sums = LAYER4_COUNTERS[protocol]
+            end  = data["te"].max()
+            # the whole capture, and the streaming periods users zoom on
+            for window in [(0, end), *periods]:
+                selected = data[(data["te"] >= window[0]) & (data["ts"] <= window[1])]
+                expected = selected.groupby("id")[sums].sum()
+                for shapes in [1000, 50, 1]:
+                    merged = __level_of_detail(data=selected, y="id", xs="ts", xe="te", sums=sums,
+                                               window=window, shapes=shapes)
+                    result = merged.groupby("id")[sums].sum().reindex(expected.index)
+                    checked += expected.size
+                    differ  += int((~numpy.isclose(result, expected, rtol=1e-9)).sum())
+        return checked, differ
+
+    def spreading():
+        # every bin an interval touches, with the length of the overlap
+        data = frames[Document.LOG_TCP_PERIODIC]
+        ts, te = data["ts"].to_numpy(dtype="float64"), data["te"].to_numpy(dtype="float64")
+        step = 3000
+        bins = int(te.max() // step) + 1
+        rows, index, overlap = spread(ts, te, step, bins)
+        result = set(zip(rows.tolist(), index.tolist(), overlap.tolist()))
+
+        expected = set()
+        for row in range(len(ts)):
+            for b in range(bins):
+                if b * step <= te[row] and (b + 1) * step >= ts[row]:
+                    expected.add((row, b, min(te[row], (b + 1) * step) - max(ts[row], b * step)))
+        return len(expected), len(result ^ expected)
+
+    def joining():
+        # the most recently opened flow towards the host still alive when the response ends
+        hcom, tcom = frames[Document.LOG_HAR_COMPLETE], frames[Document.LOG_TCP_COMPLETE]
+        result = link(hcom, tcom)
+
+        hosts  = url_hosts(hcom["url"]).to_numpy(dtype=object)
+        times  = hcom["te"].to_numpy(dtype="float64")
+        cnames = tcom["cname"].astype(str).to_numpy(dtype=object)
+        ts, te = tcom["ts"].to_numpy(dtype="float64"), tcom["te"].to_numpy(dtype="float64")
+        differ = 0
+        for i in range(len(hcom)):
+            found = numpy.flatnonzero((cnames == hosts[i]) & (ts <= times[i]) & (te >= times[i]))
+            expected = found[ts[found] == ts[found].max()].max() if len(found) else -1
+            differ += int(result[i] != expected)
+        return len(hcom), differ
+
+    def bucketing():
+        # transactions of each kind starting within each period, bounds included;
+        # the experiment twice, to lay more than one on the timeline
+        hcom   = frames[Document.LOG_HAR_COMPLETE]
+        counts = period_counts(transactions={"a": hcom, "b": hcom}, periods={"a": periods, "b": periods})
+        checked = differ = 0
+        for row, (ts, te) in enumerate(periods * 2):
+            inside = hcom[(hcom["ts"] >= ts) & (hcom["ts"] <= te)]
+            for kind in CLASSES:
+                checked += 1
+                differ  += int(counts.at[row, kind] != (inside["kind"] == kind).sum())
+        return checked, differ
+
+    def windows():
+        # windowed reads return the rows of the whole log overlapping the window
+        checked = differ = 0
+        for document in [document for document in DOCUMENTS if document in SORTED]:
+            data = read_log(paths[document], document)
+            end  = data["te"].max()
+            for window in [(0, end), (end / 3, end / 2), (end + 1, end + 2), *periods]:
+                result   = read_log(paths[document], document, window=window)
+                expected = data[(data["te"] >= window[0]) & (data["ts"] <= window[1])]
+                checked += 1
+                differ  += int(not result.equals(expected))
+        return checked, differ
+
+    def streaming():
+        # chunked reductions against the logs as the dashboard loads them, and
+        # streamed binning against binning from the cached logs
+        hosts   = frames[Document.LOG_TCP_COMPLETE]["cname"].value_counts().index[:2].tolist()
+        checked = differ = 0
+        for document in [Document.LOG_TCP_PERIODIC, Document.LOG_HAR_COMPLETE]:
+            key, sums = REDUCERS[document]
+            data = read_log(paths[document], document)
+            host = data["cname"] if "cname" in data.columns else url_hosts(data["url"])
+            # flows by their text, or number, as the reducer names them
+            ids  = data[key].astype("float64") if pandas.api.types.is_numeric_dtype(data[key]) else data[key].astype(str)
+            for cnames, window in [(None, None), (hosts, None), (hosts, periods[0])]:
+                keep = host.isin(cnames) if cnames is not None else numpy.ones(len(data), dtype=bool)
+                if window is not None:
+                    keep &= (data["te"] >= window[0]) & (data["ts"] <= window[1])
+                grouped  = data[keep].groupby(ids[keep])
+                expected = grouped[sums].sum().assign(rows=grouped.size()).sort_index()
+                result   = chunked(paths[document], document, by="flow", cnames=cnames, window=window, block=1 << 16)
+                result   = result[[*sums, "rows"]].reindex(expected.index)
+                checked += expected.size
+                differ  += int((~numpy.isclose(result, expected, rtol=1e-9)).sum()) + abs(len(result) - len(expected))
+        for step in [1000, 3000]:
+            cached, streamed = bin_experiment(root, step), bin_experiment(root, step, limit=0)
+            for protocol, logs in cached.items():
+                for expected, result in zip(logs, streamed[protocol]):
+                    checked += expected.size
+                    differ  += int((~numpy.isclose(result, expected, rtol=1e-9)).sum())
+                differ += abs(len(logs) - len(streamed[protocol]))
+        return checked, differ
+
+    return {f"{name}/check/hover": hover, f"{name}/check/level_of_detail": detail,
+            f"{name}/check/spread": spreading, f"{name}/check/join": joining,
+            f"{name}/check/period_counts": bucketing, f"{name}/check/windows": windows,
+            f"{name}/check/chunks": streaming}
+
+def media_checks(rate: str) -> dict[str, Callable[[], tuple[int, int]]]:
+    folder = os.path.join(SERVER, rate, "media", "tcp", STEPS[0])
+    files  = sorted(os.listdir(folder))[:MEDIA]
+    logs   = [read_log(os.path.join(folder, file), Document.LOG_TCP_MEDIA) for file in files]
+
+    def rollups():
+        # counters of the coarser bins, summed from the finest log
+        checked = differ = 0
+        for data in logs:
+            merged = rollup(data, [int(step) for step in STEPS[1:]])
+            counters = [column for column in COUNTERS if column in data.columns]
+            for step, result in merged.items():
+                expected = data[counters].astype("float64").groupby(data["ts"] // step).sum()
+                result   = result.set_index(result["ts"] // step)[counters]
+                checked += expected.size
+                differ  += int((~numpy.isclose(result.reindex(expected.index), expected, rtol=1e-9)).sum())
+        return checked, differ
+
+    def trees():
+        # counters rolled up from the finest log, against the trees Tstat binned at the coarser steps
+        checked = differ = 0
+        for file, data in zip(files, logs):
+            merged = rollup(data, [int(step) for step in STEPS[1:]])
+            for step, result in merged.items():
+                path     = os.path.join(SERVER, rate, "media", "tcp", str(step), file)
+                expected = read_log(path, Document.LOG_TCP_MEDIA).set_index("ts")[COUNTERS].astype("float64")
+                result   = result.set_index("ts")[COUNTERS].reindex(expected.index)
+                # the logs hold float32 counters
+                checked += expected.size
+                differ  += int((~numpy.isclose(result, expected, rtol=1e-6)).sum())
+        return checked, differ
+
+    def merging():
+        # running mean and deviation of every timestamp, over the logs folded one by one
+        aggregate = Aggregate(AGGREGATED)
+        for data in logs:
+            aggregate.fold(data)
+        result = aggregate.frame().set_index("ts")
+
+        data = pandas.concat([data.drop_duplicates("ts") for data in logs])
+        checked = differ = 0
+        for column, (source, zeros) in AGGREGATED.items():
+            values  = data[source].where(data[source] != 0) if zeros else data[source]
+            grouped = values.groupby(data["ts"])
+            for expected, got in [(grouped.mean(), result[column]), (grouped.std(ddof=0), result[f"{column}_std"])]:
+                got = got.reindex(expected.index)
+                checked += len(expected)
+                differ  += int((~numpy.isclose(got, expected, rtol=1e-7, atol=1e-6, equal_nan=True)).sum())
+        return checked, differ
+
+    return {f"media/check/rollup/{rate}": rollups, f"media/check/trees/{rate}": trees,
+            f"media/check/aggregate/{rate}": merging}
+
+def measure(run: Callable[[], go.Figure | None], repeat: int) -> dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start  = time.perf_counter()
+        figure = run()
+        times.append(time.perf_counter() - start)
+
+    # memory is traced on a separate run, tracing slows everything down
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"time":   sorted(times)[len(times) // 2],
+            "memory": peak,
+            "size":   len(figure.to_json()) if figure is not None else 0}
+
+def regressions(result: dict[str, float], baseline: dict[str, float] | None) -> list[str]:
+    if baseline is None:
+        return []
+    return [metric for metric, factor in TOLERANCE.items()
+            if result[metric] > baseline[metric] * factor + SLACK[metric]]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of the dashboard")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--repeat", default=5, type=int, help="runs of every case")
+    parser.add_argument("--filter", default="", help="run only the cases containing this text")
+    args = parser.parse_args()
+
+    # shared resources and caches work without a script run context, quietly;
+    # loading the configuration resets the level unless it is set there too
+    streamlit.config.set_option("logger.level", "error")
+    streamlit.logger.set_log_level("error")
+
+    # plotly drops the nanoseconds of the timestamps it serializes, as in the app
+    warnings.filterwarnings("ignore", message="Discarding nonzero nanoseconds")
+
+    try:
+        with open(BASELINE) as file:
+            baselines = json.load(file)
+    except (OSError, ValueError):
+        baselines = {}
+
+    cases = {}
+    for rate, test in EXPERIMENTS:
+        cases.update(experiment_cases(rate, test))
+    cases.update(media_cases())
+
+    checks = {}
+    for rate, test in EXPERIMENTS:
+        checks.update(check_cases(rate, test))
+    checks.update(media_checks(EXPERIMENTS[0][0]))
+    checks.update(edge_checks())
+
+    results = {}
+    failed  = []
+    print(f"{'case':<55} {'time [ms]':>10} {'peak [MiB]':>11} {'figure [KiB]':>13}  status")
+    for name, run in cases.items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(run, args.repeat)
+        metrics = regressions(results[name], baselines.get(name))
+        status  = "new" if name not in baselines else ("REGRESSION " + ", ".join(metrics) if metrics else "ok")
+        if metrics:
+            failed.append(name)
+        print(f"{name:<55} {results[name]['time'] * 1000:>10.1f} {results[name]['memory'] / 2 ** 20:>11.1f} "
+              f"{results[name]['size'] / 1024:>13.1f}  {status}")
+
+    # results are checked whatever the baselines, a difference is never intended
+    different = []
+    print(f"{'check':<55} {'values':>10} {'differ':>11}")
+    for name, check in checks.items():
+        if args.filter not in name:
+            continue
+        checked, differ = check()
+        if differ:
+            different.append(name)
+        print(f"{name:<55} {checked:>10} {differ:>11}  {'DIFFERENT' if differ else 'ok'}")
+
+    if args.update:
+        baselines.update(results)
+        with open(BASELINE, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f"baselines stored in {BASELINE}")
+        failed = []
+
+    if failed:
+        print(f"{len(failed)} case(s) regressed: {', '.join(failed)}", file=sys.stderr)
+    if different:
+        print(f"{len(different)} check(s) differ: {', '.join(different)}", file=sys.stderr)
+    return 1 if failed or different else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
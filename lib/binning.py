@@ -0,0 +1,227 @@
+import os
+import time
+import argparse
+import concurrent.futures
+import numpy
+import pandas
+
+from lib.generic import Protocol
+from lib.generic import Document
+from lib.generic import __extract_streaming_periods
+
+from lib.generic import LOG_BOT_COMPLETE
+from lib.generic import LOG_HAR_COMPLETE
+from lib.generic import LOG_TCP_PERIODIC
+from lib.generic import LOG_UDP_PERIODIC
+from lib.generic import LOG_AUDIO_COMPLETE
+from lib.generic import LOG_VIDEO_COMPLETE
+
+from lib.storage import read_log
+
+from lib.experiment import load_meta
+
+from lib.catalog import load_catalog
+
+from lib.chunks import spread
+from lib.chunks import read_chunks
+
+# Time binning of raw logs
+# Builds the binned media logs of <server>/<rate>/media/<protocol>/<step>
+# from the logs of an experiment, at any step. Every streaming period is cut
+# into bins of the step (ms) from its start, and is binned for the protocol
+# that carried most of its CDN bytes. The periodic bins of the CDN flows are
+# spread over the bins they overlap, and their counters are split in
+# proportion to the overlap. Video, audio and manifest (mpd) requests fall in
+# the bin of their start. As in the pre-binned logs, bins are closed
+# intervals: a periodic bin or a request on the border of two bins counts in
+# both, and periodic bins starting after the end of the period are left out.
+# Everything is reduced with bincount and reduceat over flat arrays, with no
+# loop over bins or rows. The output matches the pre-binned logs, except
+# that requests past the end of a period are all counted in its last bin,
+# where the offline tool sometimes drops one, and that every manifest
+# request is counted, where the offline tool misses about one in a hundred.
+# The periodic logs of long captures are streamed through lib.chunks, and
+# only the bins of the CDN flows are kept in memory. Binning is an offline
+# tool, the dashboard reads the media trees: the experiments hold a few UDP
+# streaming periods the offline tool left out of the trees, so steps binned
+# here would not average the same periods as the stored ones.
+#
+#   python -m lib.binning RATE [RATE ...] --step MS [--server dazn] [--output DIR]
+
+SERVER = "dazn"
+
+# periodic logs larger than this (bytes) are read chunk by chunk
+LONG = 64 << 20
+
+# counters of the periodic logs, split over the bins; udp logs have only some of them
+COUNTERS = [
+    "c_pkts_all", "c_ack_cnt", "c_ack_cnt_p", "c_bytes_all", "c_bytes_uniq",
+    "s_pkts_all", "s_ack_cnt", "s_ack_cnt_p", "s_bytes_all", "s_bytes_uniq",
+    "c_pkts_retx", "s_pkts_retx", "c_pkts_data", "s_pkts_data"]
+
+# periodic logs, by protocol
+PERIODIC = {
+    Protocol.TCP: (LOG_TCP_PERIODIC, Document.LOG_TCP_PERIODIC),
+    Protocol.UDP: (LOG_UDP_PERIODIC, Document.LOG_UDP_PERIODIC),
+}
+
+# request logs, by media kind
+REQUESTS = {
+    "video": (LOG_VIDEO_COMPLETE, Document.LOG_VIDEO_COMPLETE),
+    "audio": (LOG_AUDIO_COMPLETE, Document.LOG_AUDIO_COMPLETE),
+}
+
+
+def stamp(times: numpy.ndarray, step: int, bins: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # every time in its bin, and in the previous one too when it lies on their border
+    index = numpy.floor(times / step).astype("int64")
+    rows  = numpy.arange(len(times))
+    rows  = numpy.concatenate([rows, rows[(times % step == 0) & (index > 0)]])
+    index = numpy.concatenate([index, index[(times % step == 0) & (index > 0)] - 1])
+    inside = (index >= 0) & (index < bins)
+    return rows[inside], index[inside]
+
+def statistics(values: numpy.ndarray, index: numpy.ndarray, bins: int) -> tuple[numpy.ndarray, ...]:
+    # number of samples, maximum, minimum, mean and (sample) standard deviation per bin;
+    # bins without samples report zeros
+    count = numpy.bincount(index, minlength=bins)
+    total = numpy.bincount(index, values, minlength=bins)
+    power = numpy.bincount(index, values * values, minlength=bins)
+
+    # extremes over the runs of samples of the same bin
+    high = numpy.zeros(bins)
+    low  = numpy.zeros(bins)
+    if len(index):
+        order  = numpy.argsort(index, kind="stable")
+        runs   = index[order]
+        starts = numpy.flatnonzero(numpy.r_[True, runs[1:] != runs[:-1]])
+        high[runs[starts]] = numpy.maximum.reduceat(values[order], starts)
+        low[runs[starts]]  = numpy.minimum.reduceat(values[order], starts)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        mean = numpy.where(count > 0, total / count, 0)
+        var  = numpy.where(count > 1, (power - count * mean * mean) / (count - 1), 0)
+    return count, high, low, mean, numpy.sqrt(numpy.maximum(var, 0))
+
+def bin_period(periodic: pandas.DataFrame, requests: dict[str, pandas.DataFrame | None],
+               manifests: numpy.ndarray, start: float, end: float, step: int) -> pandas.DataFrame:
+    # media log of one streaming period; periodic holds the bins of the CDN
+    # flows, requests the video and audio requests, manifests the start of
+    # the mpd requests, all with absolute times (ms)
+    bins = int(numpy.ceil((end - start) / step))
+    data = {"ts": numpy.arange(bins) * float(step)}
+    data["te"] = data["ts"] + step
+
+    ts = periodic["ts"].to_numpy(dtype="float64") - start
+    te = periodic["te"].to_numpy(dtype="float64") - start
+    rows, index, overlap = spread(ts, te, step, bins)
+    keep = ts[rows] <= end - start
+    rows, index, overlap = rows[keep], index[keep], overlap[keep]
+
+    # connections are the distinct flows of a bin
+    flows = periodic["id"].cat.codes.to_numpy(dtype="int64")[rows]
+    pairs = numpy.unique(index * (flows.max(initial=0) + 1) + flows)
+    data["nbins"] = numpy.bincount(index, minlength=bins)
+    data["ncons"] = numpy.bincount(pairs // (flows.max(initial=0) + 1), minlength=bins)
+
+    span = (te - ts)[rows]
+    share = numpy.divide(overlap, span, out=numpy.zeros_like(overlap), where=span > 0)
+    for column in [column for column in COUNTERS if column in periodic.columns]:
+        data[column] = numpy.bincount(index, periodic[column].to_numpy(dtype="float64")[rows] * share, minlength=bins)
+
+    _, *values = statistics(overlap, index, bins)
+    data.update(zip(["max_bin_duration", "min_bin_duration", "avg_bin_duration", "std_bin_duration"], values))
+
+    counts = {}
+    for kind in REQUESTS:
+        frame = requests.get(kind)
+        times = frame["ts"].to_numpy(dtype="float64") - start if frame is not None else numpy.empty(0)
+        rates = frame["rate"].to_numpy(dtype="float64") if frame is not None else numpy.empty(0)
+        rows, index = stamp(times, step, bins)
+        counts[kind], *values = statistics(rates[rows], index, bins)
+        data.update(zip([f"max_{kind}_rate", f"min_{kind}_rate", f"avg_{kind}_rate", f"std_{kind}_rate"], values))
+
+    data["video_reqs"] = counts["video"]
+    data["audio_reqs"] = counts["audio"]
+    data["media_reqs"] = numpy.bincount(stamp(manifests - start, step, bins)[1], minlength=bins)
+    return pandas.DataFrame(data)
+
+def cdn_bins(path: str, document: Document, limit: int = LONG) -> pandas.DataFrame | None:
+    # periodic bins of the CDN flows; a log beyond the limit is never loaded whole
+    columns = ["id", "ts", "te", "cdn"] + COUNTERS
+    if not os.path.exists(path) or os.path.getsize(path) <= limit:
+        data = read_log(path, document, columns=columns)
+        return data[data["cdn"].notna()] if data is not None else None
+
+    chunks = [data[data["cdn"].notna()] for data in read_chunks(path, document, columns=columns)]
+    if not chunks:
+        return None
+    # flows are told apart by the codes of their id, as in the cached logs
+    data = pandas.concat(chunks, ignore_index=True)
+    return data.assign(id=data["id"].astype("category"))
+
+def bin_experiment(root: str, step: int, limit: int = LONG) -> dict[Protocol, list[pandas.DataFrame]]:
+    # media logs of the streaming periods of an experiment, by the protocol
+    # they are binned for; periods without CDN traffic are left out
+    meta    = load_meta(os.path.join(root, LOG_BOT_COMPLETE))
+    periods = __extract_streaming_periods(frame=meta) if meta is not None else []
+
+    periodic = {protocol: cdn_bins(os.path.join(root, name), document, limit)
+                for protocol, (name, document) in PERIODIC.items()}
+
+    requests = {kind: read_log(os.path.join(root, name), document, columns=["ts", "rate"])
+                for kind, (name, document) in REQUESTS.items()}
+
+    hcom = read_log(os.path.join(root, LOG_HAR_COMPLETE), Document.LOG_HAR_COMPLETE, columns=["ts", "kind"])
+    manifests = hcom.loc[hcom["kind"] == "mpd", "ts"].to_numpy(dtype="float64") if hcom is not None else numpy.empty(0)
+
+    logs = {protocol: [] for protocol in PERIODIC}
+    for start, end in periods:
+        binned = {protocol: bin_period(data, requests, manifests, start, end, step)
+                  for protocol, data in periodic.items() if data is not None}
+        volumes = {protocol: data["s_bytes_all"].sum() for protocol, data in binned.items()}
+        if not volumes or max(volumes.values()) <= 0:
+            continue
+        protocol = max(volumes, key=volumes.get)
+        logs[protocol].append(binned[protocol])
+    return logs
+
+def bin_rate(server: str, rate: str, step: int,
+             executor: concurrent.futures.Executor | None = None) -> dict[Protocol, list[pandas.DataFrame]]:
+    # media logs of every experiment of a rate, in the order of the experiments
+    roots = [os.path.join(server, rate, test) for test in load_catalog(server).tests(rate)]
+
+    apply = executor.map if executor is not None else map
+    logs  = {protocol: [] for protocol in PERIODIC}
+    for result in apply(bin_experiment, roots, [step] * len(roots)):
+        for protocol, frames in result.items():
+            logs[protocol].extend(frames)
+    return logs
+
+def write_logs(output: str, logs: dict[Protocol, list[pandas.DataFrame]]):
+    # same layout and format as the media trees, <output>/<protocol>/log_<protocol>_media_N
+    for protocol, frames in logs.items():
+        name = protocol.name.lower()
+        os.makedirs(os.path.join(output, name), exist_ok=True)
+        for i, frame in enumerate(frames):
+            frame.to_csv(os.path.join(output, name, f"log_{name}_media_{i}"), sep=" ", index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bin the experiments of some rates at any step")
+    parser.add_argument("rates", nargs="+", help="rates to bin, e.g. 1.5Mbps")
+    parser.add_argument("--step",    required=True, type=int, help="width of the bins (ms)")
+    parser.add_argument("--server",  default=SERVER, help="folder of the experiments")
+    parser.add_argument("--output",  default=None, help="folder the media logs are written to, one per rate")
+    parser.add_argument("--workers", default=None, type=int, help="number of threads")
+    args = parser.parse_args()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for rate in args.rates:
+            start = time.perf_counter()
+            logs  = bin_rate(args.server, rate, args.step, executor)
+            print(f"{rate}: {sum(len(frames) for frames in logs.values())} periods "
+                  f"({', '.join(f'{len(frames)} {protocol.name.lower()}' for protocol, frames in logs.items())}) "
+                  f"binned at {args.step} ms in {time.perf_counter() - start:.2f} s")
+            if args.output:
+                write_logs(os.path.join(args.output, rate, str(args.step)), logs)
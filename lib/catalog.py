@@ -0,0 +1,255 @@
+import os
+import json
+import threading
+import streamlit
+
+import watchdog.events
+import watchdog.observers
+
+from lib.generic import Document
+from lib.generic import TESTBED_RATES
+from lib.generic import get_number
+
+from lib.generic import LOG_BOT_COMPLETE
+from lib.generic import LOG_HAR_COMPLETE
+from lib.generic import LOG_TCP_COMPLETE
+from lib.generic import LOG_UDP_COMPLETE
+from lib.generic import LOG_TCP_PERIODIC
+from lib.generic import LOG_UDP_PERIODIC
+from lib.generic import LOG_AUDIO_COMPLETE
+from lib.generic import LOG_VIDEO_COMPLETE
+
+from lib.storage import CACHE
+from lib.storage import read_log
+from lib.storage import file_signature
+
+# Dataset catalog
+# Index of the <server>/<rate>/test-N and <server>/<rate>/media/<protocol>/<step>
+# folders, recording size and modification time of every file and, for the
+# logs of an experiment, their number of rows, their time span and the bot
+# events. The catalog is built from directory listings and file stamps only,
+# a log is read the first time its rows, span or events are asked for. It is
+# saved in the cache and kept up to date by a watchdog observer: a folder is
+# listed again only after a filesystem event touched it, and the details of
+# its changed logs are dropped. Without an observer (e.g. out of inotify
+# watches) every folder is checked on access.
+
+# logs of an experiment, by file name
+LOGS = {
+    LOG_BOT_COMPLETE:   Document.LOG_BOT_COMPLETE,
+    LOG_HAR_COMPLETE:   Document.LOG_HAR_COMPLETE,
+    LOG_TCP_COMPLETE:   Document.LOG_TCP_COMPLETE,
+    LOG_UDP_COMPLETE:   Document.LOG_UDP_COMPLETE,
+    LOG_TCP_PERIODIC:   Document.LOG_TCP_PERIODIC,
+    LOG_UDP_PERIODIC:   Document.LOG_UDP_PERIODIC,
+    LOG_AUDIO_COMPLETE: Document.LOG_AUDIO_COMPLETE,
+    LOG_VIDEO_COMPLETE: Document.LOG_VIDEO_COMPLETE,
+}
+
+# filesystem events changing the content of a folder
+CHANGES = {
+    watchdog.events.EVENT_TYPE_CREATED,
+    watchdog.events.EVENT_TYPE_DELETED,
+    watchdog.events.EVENT_TYPE_MODIFIED,
+    watchdog.events.EVENT_TYPE_MOVED,
+    watchdog.events.EVENT_TYPE_CLOSED,
+}
+
+# bump whenever the content of an entry changes
+VERSION = 2
+
+
+def rate_order(name: str) -> tuple:
+    # testbed rates first, in their order, then anything else by name
+    return (TESTBED_RATES.index(name), "") if name in TESTBED_RATES else (len(TESTBED_RATES), name)
+
+def stat_files(root: str) -> dict[str, list[int]]:
+    files = {}
+    for entry in os.scandir(root):
+        if entry.is_file():
+            stat = entry.stat()
+            files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+def scan_log(path: str, document: Document) -> dict:
+    data = read_log(path, document, columns=["ts", "te", "event", "rel"])
+
+    info = {"rows": len(data)}
+    for column, reduce in (("ts", min), ("te", max)):
+        if column in data.columns and len(data):
+            info[column] = float(reduce(data[column]))
+    if document == Document.LOG_BOT_COMPLETE:
+        info["events"] = [[str(event), float(rel)] for event, rel in zip(data["event"], data["rel"])]
+    return info
+
+
+class Handler(watchdog.events.FileSystemEventHandler):
+
+    def __init__(self, catalog: "Catalog"):
+        self.catalog = catalog
+
+    def on_any_event(self, event: watchdog.events.FileSystemEvent):
+        if event.event_type not in CHANGES:
+            return
+        self.catalog.invalidate(event.src_path)
+        if event.event_type == watchdog.events.EVENT_TYPE_MOVED:
+            self.catalog.invalidate(event.dest_path)
+
+
+class Catalog:
+
+    def __init__(self, server: str):
+        self.server   = server
+        self.path     = os.path.join(CACHE, "catalog", f"{server}.json")
+        self.lock     = threading.Lock()
+        self.observer = None
+        self.entries  = self.__load()
+        # folders to check again, None stands for all of them
+        self.dirty    = None
+
+    def __load(self) -> dict:
+        try:
+            with open(self.path) as file:
+                catalog = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return catalog.get("entries", {}) if catalog.get("version") == VERSION else {}
+
+    def __save(self):
+        temp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp, "w") as file:
+                json.dump({"version": VERSION, "entries": self.entries}, file)
+            os.replace(temp, self.path)
+        except OSError:
+            # the catalog is rebuilt from scratch on the next start
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def watch(self):
+        observer = watchdog.observers.Observer()
+        observer.schedule(Handler(self), self.server, recursive=True)
+        observer.daemon = True
+        try:
+            observer.start()
+        except OSError:
+            return
+        self.observer = observer
+
+    def invalidate(self, path: str):
+        parts = os.path.relpath(path, self.server).split(os.sep)
+        with self.lock:
+            if self.dirty is None:
+                return
+            if len(parts) >= 2 and parts[1].startswith("test"):
+                self.dirty.add("/".join(parts[:2]))
+            elif len(parts) >= 4 and parts[1] == "media":
+                self.dirty.add("/".join(parts[:4]))
+            else:
+                # a rate or a media folder appeared or disappeared
+                self.dirty = None
+
+    def __folders(self) -> list[str]:
+        folders = []
+        for rate in os.listdir(self.server):
+            if not os.path.isdir(os.path.join(self.server, rate)):
+                continue
+            for name in os.listdir(os.path.join(self.server, rate)):
+                if name.startswith("test"):
+                    folders.append(f"{rate}/{name}")
+            media = os.path.join(self.server, rate, "media")
+            if os.path.isdir(media):
+                for protocol in os.listdir(media):
+                    for step in os.listdir(os.path.join(media, protocol)):
+                        folders.append(f"{rate}/media/{protocol}/{step}")
+        return folders
+
+    def __update(self, folder: str) -> bool:
+        root = os.path.join(self.server, folder)
+        if not os.path.isdir(root):
+            return self.entries.pop(folder, None) is not None
+
+        files = stat_files(root)
+        entry = self.entries.get(folder, {"files": {}})
+        known = entry["files"]
+        if files.keys() == known.keys() and all(known[name]["stat"] == stat for name, stat in files.items()):
+            return False
+
+        # the details of unchanged logs are kept, the changed ones are read again when asked for
+        self.entries[folder] = {"files": {name: known[name] if name in known and known[name]["stat"] == stat
+                                          else {"stat": stat} for name, stat in files.items()}}
+        return True
+
+    def refresh(self):
+        with self.lock:
+            if self.observer is not None and self.dirty is not None and not self.dirty:
+                return
+            if self.observer is None or self.dirty is None:
+                folders = self.__folders()
+                removed = set(self.entries) - set(folders)
+            else:
+                folders = self.dirty
+                removed = set()
+
+            changed = bool(removed)
+            for folder in removed:
+                del self.entries[folder]
+            for folder in folders:
+                changed |= self.__update(folder)
+
+            self.dirty = set()
+            if changed:
+                self.__save()
+
+    def rates(self) -> list[str]:
+        self.refresh()
+        return sorted({folder.split("/")[0] for folder in self.entries}, key=rate_order)
+
+    def tests(self, rate: str) -> list[str]:
+        self.refresh()
+        tests = [folder.split("/")[1] for folder in self.entries
+                 if folder.startswith(f"{rate}/test")]
+        return sorted(tests, key=get_number)
+
+    def test(self, rate: str, test: str) -> dict[str, dict]:
+        self.refresh()
+        return self.entries.get(f"{rate}/{test}", {"files": {}})["files"]
+
+    def log(self, rate: str, test: str, name: str) -> dict:
+        # stamp, number of rows, time span and, for the bot log, events of a log of an experiment
+        self.refresh()
+        with self.lock:
+            info = dict(self.entries.get(f"{rate}/{test}", {"files": {}})["files"].get(name, {}))
+        if not info or "rows" in info or name not in LOGS:
+            return info
+
+        # read outside of the lock, the entry is kept only if the log did not change meanwhile
+        info.update(scan_log(os.path.join(self.server, rate, test, name), LOGS[name]))
+        with self.lock:
+            files = self.entries.get(f"{rate}/{test}", {"files": {}})["files"]
+            if name in files and files[name]["stat"] == info["stat"]:
+                files[name] = info
+                self.__save()
+        return info
+
+    def stamp(self, rate: str, test: str) -> tuple:
+        # names, sizes and modification times of the files of an experiment
+        files = self.test(rate, test)
+        return tuple((name, *files[name]["stat"]) for name in sorted(files))
+
+    def media(self, rate: str, protocol: str, step: str, document: Document) -> dict[str, bytes]:
+        # media logs of a folder, with the signature of their cached copies
+        self.refresh()
+        root  = os.path.join(self.server, rate, "media", protocol, step)
+        files = self.entries.get(f"{rate}/media/{protocol}/{step}", {"files": {}})["files"]
+        return {os.path.join(root, name): file_signature(*info["stat"], document) for name, info in files.items()}
+
+
+@streamlit.cache_resource(show_spinner="Indexing experiments...")
+def load_catalog(server: str) -> Catalog:
+    # shared by every session, the observer keeps it up to date
+    catalog = Catalog(server)
+    catalog.watch()
+    catalog.refresh()
+    return catalog
@@ -0,0 +1,197 @@
+import os
+import argparse
+import numpy
+import pandas
+import pyarrow
+import pyarrow.csv
+
+from typing import Iterable
+from typing import Iterator
+
+from lib.generic import Protocol
+from lib.generic import Document
+from lib.generic import LAYER4_COUNTERS
+
+from lib.storage import PARSE
+from lib.storage import read_log
+
+from lib.schema import text_columns
+
+from lib.classify import classify
+
+from lib.join import url_hosts
+
+# Out-of-core processing of Tstat logs
+# The periodic and HAR logs of a long capture need not fit in memory: they
+# are read as a stream of chunks of rows (one block of text each), filtered
+# by cname and time window, and reduced chunk by chunk into the rows of a
+# flow (sums of counters, first start, last end, number of rows) or into the
+# bins of a step (sums of counters, number of rows). Memory is bounded by one
+# block plus the reduced state, which grows with the number of flows or bins,
+# never with the rows. HAR logs have no cname, a transaction is selected by
+# the host of its url, as lib.join matches it with the flows. Reducers
+# accept any sequence of frames, so the in-memory path (a whole log as a
+# single frame) goes through the same code and gives the same results, up to
+# the rounding of float sums. Chunks are not converted with lib.schema, as
+# categories would differ from one chunk to another: text stays text and
+# numbers are read as float64. The labels of lib.classify have fixed
+# categories and are added to every chunk.
+#
+#   python -m lib.chunks PATH --by flow|bin [--step MS] [--cnames C ...] [--window TS TE]
+
+# bytes of text parsed at once
+BLOCK = 1 << 20
+
+# documents reduced by flow, with the column identifying the flow and the counters summed
+REDUCERS = {
+    Document.LOG_TCP_PERIODIC: ("id", LAYER4_COUNTERS[Protocol.TCP]),
+    Document.LOG_UDP_PERIODIC: ("id", LAYER4_COUNTERS[Protocol.UDP]),
+    Document.LOG_HAR_COMPLETE: ("connection", ["size"]),
+}
+
+# documents whose rows are intervals spread over the bins they overlap;
+# the transactions of the other logs fall in the bin of their start
+INTERVALS = {Document.LOG_TCP_PERIODIC, Document.LOG_UDP_PERIODIC}
+
+
+def spread(ts: numpy.ndarray, te: numpy.ndarray, step: int, bins: int) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    # every interval repeated over the bins it touches: its position, the
+    # bin and the length of the overlap (zero when they only share a border)
+    first = numpy.clip(numpy.ceil(ts / step).astype("int64") - 1, 0, None)
+    last  = numpy.clip(numpy.floor(te / step).astype("int64"), None, bins - 1)
+    sizes = numpy.maximum(last - first + 1, 0)
+
+    rows  = numpy.repeat(numpy.arange(len(ts)), sizes)
+    index = first[rows] + numpy.arange(len(rows)) - numpy.repeat(numpy.cumsum(sizes) - sizes, sizes)
+    overlap = numpy.minimum(te[rows], (index + 1) * step) - numpy.maximum(ts[rows], index * step)
+    return rows, index, overlap
+
+def log_columns(path: str) -> list[str]:
+    with open(path) as file:
+        return file.readline().split()
+
+def select(data: pandas.DataFrame, cnames: list[str] | None = None,
+           window: tuple[float, float] | None = None) -> pandas.DataFrame:
+    # rows of the cnames overlapping the window (ms), as the timelines select them
+    keep = numpy.ones(len(data), dtype=bool)
+    if cnames is not None and "cname" in data.columns:
+        keep &= data["cname"].isin(cnames).to_numpy()
+    elif cnames is not None and "url" in data.columns:
+        keep &= url_hosts(data["url"]).isin(cnames).to_numpy()
+    elif cnames is not None:
+        raise ValueError("rows without a cname or url cannot be selected by cname")
+    if window is not None:
+        keep &= ((data["te"] >= window[0]) & (data["ts"] <= window[1])).to_numpy()
+    return data[keep]
+
+def read_chunks(path: str, document: Document, columns: list[str] | None = None,
+                cnames: list[str] | None = None, window: tuple[float, float] | None = None,
+                block: int = BLOCK) -> Iterator[pandas.DataFrame]:
+    # selected rows of a log, one block at a time; columns missing from the log are left out
+    if not os.path.exists(path):
+        return
+    header  = log_columns(path)
+    columns = [column for column in (columns or header) if column in header]
+    # the columns selecting and labelling rows are read too, the url only to select by its host
+    extra   = ["cname", "ts", "te"] + (["url"] if cnames is not None and "cname" not in header else [])
+    needed  = columns + [column for column in extra if column in header and column not in columns]
+
+    text    = set(text_columns(document))
+    convert = pyarrow.csv.ConvertOptions(
+        include_columns=needed, strings_can_be_null=True, timestamp_parsers=[],
+        column_types={column: pyarrow.string() if column in text else pyarrow.float64() for column in needed})
+    reader  = pyarrow.csv.open_csv(path, read_options=pyarrow.csv.ReadOptions(block_size=block),
+                                   parse_options=PARSE, convert_options=convert)
+    for batch in reader:
+        data = select(batch.to_pandas(), cnames=cnames, window=window)
+        yield classify(data, document)[columns + [column for column in ["cdn", "kind"] if column in data.columns]]
+
+def reduce_flows(chunks: Iterable[pandas.DataFrame], key: str, sums: list[str]) -> pandas.DataFrame:
+    # one row per flow: first start, last end, number of rows and the sums of the counters
+    state = None
+    for data in chunks:
+        if data.empty:
+            continue
+        # flows by their text, or number, whatever the dtype of the chunk
+        name = data[key].astype("float64") if pandas.api.types.is_numeric_dtype(data[key]) else data[key].astype(str)
+        part = data.groupby(name, sort=False).agg(
+            ts=("ts", "min"), te=("te", "max"), rows=("ts", "size"),
+            **{column: (column, "sum") for column in sums if column in data.columns})
+        # partial results are merged as they come, the state holds one row per flow
+        state = part if state is None else pandas.concat([state, part]).groupby(level=0, sort=False).agg(
+            {"ts": "min", "te": "max", "rows": "sum", **{column: "sum" for column in part.columns[3:]}})
+    if state is None:
+        return pandas.DataFrame(columns=["ts", "te", "rows", *sums])
+    return state.sort_index()
+
+def reduce_bins(chunks: Iterable[pandas.DataFrame], step: int, sums: list[str], intervals: bool) -> pandas.DataFrame:
+    # one row per bin of the step from time zero: number of rows and sums of the counters;
+    # intervals are spread over the bins they overlap and their counters split in proportion
+    rows   = numpy.zeros(0)
+    totals = {}
+    for data in chunks:
+        if data.empty:
+            continue
+        ts = data["ts"].to_numpy(dtype="float64")
+        if intervals:
+            te = data["te"].to_numpy(dtype="float64")
+            bins = int(numpy.floor(te.max() / step)) + 1
+            position, index, overlap = spread(ts, te, step, bins)
+            span  = (te - ts)[position]
+            share = numpy.divide(overlap, span, out=numpy.zeros_like(overlap), where=span > 0)
+        else:
+            index    = numpy.floor(ts / step).astype("int64")
+            position = numpy.arange(len(ts))
+            share    = numpy.ones(len(ts))
+            bins     = int(index.max()) + 1
+
+        # the state grows with the bins, never with the rows
+        size = max(len(rows), bins)
+        rows = numpy.pad(rows, (0, size - len(rows))) + numpy.bincount(index, minlength=size)
+        for column in [column for column in sums if column in data.columns]:
+            values = data[column].to_numpy(dtype="float64")[position] * share
+            total  = totals.get(column, numpy.zeros(0))
+            totals[column] = numpy.pad(total, (0, size - len(total))) + numpy.bincount(index, values, minlength=size)
+
+    size = len(rows)
+    return pandas.DataFrame({"ts": numpy.arange(size) * float(step), "te": (numpy.arange(size) + 1) * float(step),
+                             "rows": rows, **{column: numpy.pad(total, (0, size - len(total)))
+                                              for column, total in totals.items()}})
+
+def chunked(path: str, document: Document, by: str, step: int | None = None, cnames: list[str] | None = None,
+            window: tuple[float, float] | None = None, block: int = BLOCK) -> pandas.DataFrame:
+    # a log reduced by flow or by bin, out of core
+    key, sums = REDUCERS[document]
+    chunks = read_chunks(path, document, columns=[key, "ts", "te", *sums], cnames=cnames, window=window, block=block)
+    if by == "flow":
+        return reduce_flows(chunks, key=key, sums=sums)
+    return reduce_bins(chunks, step=step, sums=sums, intervals=document in INTERVALS)
+
+def in_memory(path: str, document: Document, by: str, step: int | None = None, cnames: list[str] | None = None,
+              window: tuple[float, float] | None = None) -> pandas.DataFrame:
+    # the same reduction over the whole log, loaded at once
+    key, sums = REDUCERS[document]
+    data = read_log(path, document)
+    data = [select(data, cnames=cnames, window=window)] if data is not None else []
+    if by == "flow":
+        return reduce_flows(data, key=key, sums=sums)
+    return reduce_bins(data, step=step, sums=sums, intervals=document in INTERVALS)
+
+
+if __name__ == "__main__":
+    documents = {"log_tcp_periodic": Document.LOG_TCP_PERIODIC,
+                 "log_udp_periodic": Document.LOG_UDP_PERIODIC,
+                 "log_har_complete": Document.LOG_HAR_COMPLETE}
+
+    parser = argparse.ArgumentParser(description="Reduce a periodic or HAR log by flow or by bin, out of core")
+    parser.add_argument("path", help="log to reduce, e.g. dazn/50Mbps/test-1/log_tcp_periodic")
+    parser.add_argument("--by",     default="flow", choices=["flow", "bin"], help="reduce by flow or by bin")
+    parser.add_argument("--step",   default=1000, type=int, help="width of the bins (ms)")
+    parser.add_argument("--cnames", default=None, nargs="+", help="keep the flows of these cnames only")
+    parser.add_argument("--window", default=None, nargs=2, type=float, help="keep the rows overlapping [TS, TE] (ms)")
+    parser.add_argument("--block",  default=BLOCK, type=int, help="bytes of text parsed at once")
+    args = parser.parse_args()
+
+    result = chunked(args.path, documents[os.path.basename(args.path)], by=args.by, step=args.step,
+                     cnames=args.cnames, window=args.window, block=args.block)
+    print(result.to_string())
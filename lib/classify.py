@@ -0,0 +1,56 @@
+import re
+import numpy
+import pandas
+
+from lib.generic import Document
+
+# Ingest time classification
+# HTTP transactions are labelled by media kind (from their mime type) and
+# layer 4 flows by the CDN serving linear content (from their cname). Every
+# label set is a single compiled regular expression with one named group per
+# label, matched once per distinct value when a log is parsed; labels are
+# stored as categorical columns of the cached log, so filtering on them
+# compares integer codes.
+
+# media kind of an HTTP transaction
+KINDS = re.compile(r"(?P<video>video)|(?P<audio>audio)|(?P<mpd>dash)")
+
+# CDN serving linear content over a flow
+CDNS = re.compile(r"(?P<daznedge>livedazn\.daznedge\.net$)"
+                  r"|(?P<akamai>livedazn\.akamaized\.net$)"
+                  r"|(?P<cloudfront>live\.cdn\.indazn\.com$)"
+                  r"|(?P<fastly>live-dazn-cdn\.dazn\.com$)")
+
+# document -> (labelled column, label column, matcher)
+CLASSIFIERS = {
+    Document.LOG_HAR_COMPLETE:   ("mime",  "kind", KINDS),
+    Document.LOG_VIDEO_COMPLETE: ("mime",  "kind", KINDS),
+    Document.LOG_AUDIO_COMPLETE: ("mime",  "kind", KINDS),
+    Document.LOG_TCP_COMPLETE:   ("cname", "cdn",  CDNS),
+    Document.LOG_TCP_PERIODIC:   ("cname", "cdn",  CDNS),
+    Document.LOG_UDP_COMPLETE:   ("cname", "cdn",  CDNS),
+    Document.LOG_UDP_PERIODIC:   ("cname", "cdn",  CDNS),
+}
+
+
+def label(values: pandas.Series, matcher: re.Pattern) -> pandas.Categorical:
+    # label of the leftmost match of each value, missing if none matches
+    values = values.astype("category")
+    labels = list(matcher.groupindex)
+
+    codes = []
+    for value in values.cat.categories:
+        match = matcher.search(str(value))
+        codes.append(labels.index(match.lastgroup) if match else -1)
+
+    # code -1 (missing values) picks the trailing -1
+    codes = numpy.array(codes + [-1], dtype="int8")
+    return pandas.Categorical.from_codes(codes[values.cat.codes.to_numpy()], categories=labels)
+
+def classify(data: pandas.DataFrame, document: Document | None) -> pandas.DataFrame:
+    if document not in CLASSIFIERS:
+        return data
+    column, name, matcher = CLASSIFIERS[document]
+    if column in data.columns:
+        data[name] = label(data[column], matcher)
+    return data
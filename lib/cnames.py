@@ -0,0 +1,147 @@
+import os
+import json
+import argparse
+import collections
+import concurrent.futures
+import pandas
+
+from lib.generic import Document
+from lib.generic import __extract_streaming_periods
+
+from lib.generic import LOG_BOT_COMPLETE
+from lib.generic import LOG_TCP_COMPLETE
+from lib.generic import LOG_UDP_COMPLETE
+
+from lib.storage import CACHE
+from lib.storage import read_log
+
+from lib.experiment import load_meta
+from lib.experiment import experiment_stamp
+
+from lib.catalog import load_catalog
+
+# CNAME statistics builder
+# Computes the statistics shown by DAZN Section #2 (res/<server>/*.txt) from
+# the experiments in <server>/<rate>/test-N. Every streaming period (a pair
+# of bot events other than sniffer, browser, origin, net and app) is a
+# sample, and a CNAME is present in a sample when one of its flows overlaps
+# the period. Experiments are summarized in a process pool, and summaries
+# are kept in the cache so that following runs only process the experiments
+# whose logs changed. The statistics in res/ are frozen: they are overwritten
+# only when asked to.
+#
+#   python -m lib.cnames [--server dazn] [--output res/dazn] [--force] [--workers N]
+
+# logs of an experiment the statistics are computed on
+FLOWS = {
+    "tcp": (LOG_TCP_COMPLETE, Document.LOG_TCP_COMPLETE),
+    "udp": (LOG_UDP_COMPLETE, Document.LOG_UDP_COMPLETE),
+}
+
+# bump whenever summarize changes the way it counts
+VERSION = 1
+
+
+def list_experiments(server: str) -> list[tuple[str, str]]:
+    catalog = load_catalog(server)
+    return [(rate, test) for rate in catalog.rates() for test in catalog.tests(rate)]
+
+def summarize(server: str, rate: str, test: str) -> dict:
+    root    = os.path.join(server, rate, test)
+    meta    = load_meta(os.path.join(root, LOG_BOT_COMPLETE))
+    periods = __extract_streaming_periods(frame=meta) if meta is not None else []
+
+    summary = {"samples": len(periods)}
+    for protocol, (name, document) in FLOWS.items():
+        flows    = 0
+        presence = collections.Counter()
+
+        data = read_log(os.path.join(root, name), document, columns=["ts", "te", "cname"])
+        if data is not None:
+            for ts, te in periods:
+                # flows overlapping the streaming period
+                mask   = (data["ts"] <= te) & (data["te"] >= ts)
+                flows += int(mask.sum())
+                presence.update(data.loc[mask, "cname"].dropna().unique().tolist())
+
+        summary[f"{protocol}_flows"] = flows
+        summary[f"{protocol}_cnames"] = dict(presence)
+    return summary
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return state.get("experiments", {}) if state.get("version") == VERSION else {}
+
+def save_state(path: str, experiments: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w") as file:
+        json.dump({"version": VERSION, "experiments": experiments}, file)
+    os.replace(temp, path)
+
+def statistics_files(output: str) -> list[str]:
+    names = [f"cnames_{protocol}.txt" for protocol in FLOWS]
+    names += ["num_samples.txt"] + [f"num_{protocol}_flows.txt" for protocol in FLOWS]
+    return [os.path.join(output, name) for name in names]
+
+def write_statistics(output: str, summaries: list[dict]):
+    os.makedirs(output, exist_ok=True)
+
+    counts = {"num_samples": sum(summary["samples"] for summary in summaries)}
+    for protocol in FLOWS:
+        counts[f"num_{protocol}_flows"] = sum(summary[f"{protocol}_flows"] for summary in summaries)
+
+        presence = collections.Counter()
+        for summary in summaries:
+            presence.update(summary[f"{protocol}_cnames"])
+
+        frame = pandas.DataFrame(presence.most_common(), columns=["cname", "abs"])
+        frame.to_csv(os.path.join(output, f"cnames_{protocol}.txt"), sep=" ", index=False)
+
+    for name, count in counts.items():
+        with open(os.path.join(output, f"{name}.txt"), "w") as file:
+            file.write(str(count))
+
+def build(server: str, output: str, workers: int | None = None) -> tuple[int, int]:
+    state = os.path.join(CACHE, "cnames", f"{server}.json")
+    known = load_state(state)
+
+    # an experiment is summarized again only if one of its files changed
+    stamps = {}
+    for rate, test in list_experiments(server):
+        # stamps are compared with the ones read back from json
+        stamp = experiment_stamp(server=server, rate=rate, test=test)
+        stamps[f"{rate}/{test}"] = [list(entry) for entry in stamp]
+
+    pending = [key for key, stamp in stamps.items() if known.get(key, {}).get("stamp") != stamp]
+
+    experiments = {key: known[key] for key in stamps if key not in pending}
+    if pending:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {key: executor.submit(summarize, server, *key.split("/")) for key in pending}
+            for key, future in futures.items():
+                experiments[key] = {"stamp": stamps[key], "summary": future.result()}
+
+    write_statistics(output, [experiments[key]["summary"] for key in sorted(experiments)])
+    save_state(state, experiments)
+    return len(pending), len(experiments)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the CNAME statistics of the experiments")
+    parser.add_argument("--server",  default="dazn", help="folder of the experiments")
+    parser.add_argument("--output",  default=None, help="folder of the statistics (default res/<server>)")
+    parser.add_argument("--force",   action="store_true", help="overwrite the statistics already in the output")
+    parser.add_argument("--workers", default=None, type=int, help="number of processes")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join("res", args.server)
+    if not args.force and any(os.path.exists(path) for path in statistics_files(output)):
+        parser.error(f"{output} already holds statistics, pass --force to overwrite them")
+
+    processed, total = build(server=args.server, output=output, workers=args.workers)
+    print(f"{processed} of {total} experiments processed")
@@ -6,25 +6,38 @@ import streamlit
 from lib.generic import Protocol
 from lib.generic import Document
 
-from lib.generic import LOG_BOT_COMPLETE
-from lib.generic import LOG_HAR_COMPLETE
-from lib.generic import LOG_TCP_COMPLETE
-from lib.generic import LOG_UDP_COMPLETE
-from lib.generic import LOG_TCP_PERIODIC
-from lib.generic import LOG_UDP_PERIODIC
-
-from lib.generic import LOG_AUDIO_COMPLETE
-from lib.generic import LOG_VIDEO_COMPLETE
-
-from lib.generic import __layer4_timeline_info
-from lib.generic import __layer7_timeline_info
 from lib.generic import __timeline
+from lib.generic import timeline_figure
+from lib.generic import fmt_flow_ids
+from lib.generic import format_layer
+from lib.generic import __level_of_detail
+from lib.generic import LAYER4_COUNTERS
 from lib.generic import __extract_streaming_periods
+from lib.generic import BOT_EVENTS
 
 
 from lib.generic import LIMIT
 
+from lib.experiment import Experiment
+from lib.experiment import load_experiment
+
+from lib.catalog import load_catalog
+
+from lib.prefetch import prefetch
+
+from lib.periods import period_counts
+
+from lib.join import transaction_bins
+
+from lib.figures import figure_key
+from lib.figures import load_figure
+
+from lib.profiler import phase
+from lib.profiler import fragment
+from lib.profiler import plotly_chart
+
 import plotly.express as px
+import plotly.graph_objects as go
 
 
 # DAZN Section #1
@@ -33,44 +46,74 @@ import plotly.express as px
 
 SERVER = "dazn"
 
-def format_layer(data: pandas.DataFrame, protocol: Protocol, document: Document):
+# complete and periodic flow logs, by protocol
+LAYER4 = {Protocol.TCP: (Document.LOG_TCP_COMPLETE, Document.LOG_TCP_PERIODIC),
+          Protocol.UDP: (Document.LOG_UDP_COMPLETE, Document.LOG_UDP_PERIODIC)}
 
-    ts, te = "ts", "te"
-    data[f"datetime_{ts}"] = pandas.to_datetime(data[ts], unit="ms", origin="unix")
-    data[f"datetime_{te}"] = pandas.to_datetime(data[te], unit="ms", origin="unix")
+def layer4_frame(data: pandas.DataFrame, 
+                 protocol: Protocol, 
+                 document: Document, cnames: list[str], window: tuple[float, float]) -> pandas.DataFrame | None:
 
-    if document in {Document.LOG_TCP_COMPLETE, Document.LOG_UDP_COMPLETE, Document.LOG_TCP_PERIODIC, Document.LOG_UDP_PERIODIC}:
-        data["info"] = data.apply(lambda r: __layer4_timeline_info(record=r, protocol=protocol, document=document), axis=1)
-    elif document == Document.LOG_HAR_COMPLETE:
-        data["info"] = data.apply(lambda r: __layer7_timeline_info(record=r), axis=1)
-    elif document == Document.LOG_AUDIO_COMPLETE:
-        data["info"] = data.apply(lambda r: __layer7_timeline_info(record=r), axis=1)
-    elif document == Document.LOG_VIDEO_COMPLETE:
-        data["info"] = data.apply(lambda r: __layer7_timeline_info(record=r), axis=1)
+    data = data[data["cname"].isin(cnames) & (data["te"] >= window[0]) & (data["ts"] <= window[1])]
+    if data.empty:
+        return None
 
+    data = data.sort_values(by="c_port", ascending=False)
+    data["id"] = fmt_flow_ids(data)
 
-def print_layer4_section(data: pandas.DataFrame, 
-                         meta: pandas.DataFrame, 
-                         protocol: Protocol, 
-                         document: Document, cnames: list[str]):
-    
-    xs, xe = "datetime_ts", "datetime_te"
+    # merge periodic bins which would not be visible in the chosen window
+    if document in {Document.LOG_TCP_PERIODIC, Document.LOG_UDP_PERIODIC}:
+        data = __level_of_detail(data=data, y="id", xs="ts", xe="te", 
+                                 sums=LAYER4_COUNTERS[protocol], window=window)
+
+        merged = data["bins"] > 1
+        if merged.any():
+            spans = data[merged].copy()
+            format_layer(data=spans, protocol=protocol, document=document)
+            data.loc[merged, ["datetime_ts", "datetime_te"]] = spans[["datetime_ts", "datetime_te"]]
+
+    return data
+
+def layer4_titles(protocol: Protocol, document: Document) -> dict[str, str]:
 
     protocol_map = {Protocol.TCP: "tcp", Protocol.UDP: "udp"}
     document_map = {
         Document.LOG_TCP_COMPLETE: "complete", Document.LOG_UDP_COMPLETE: "complete",
         Document.LOG_TCP_PERIODIC: "periodic", Document.LOG_UDP_PERIODIC: "periodic"}
 
-    xaxis_title = "time [mm:ss]"
-    yaxis_title = f"{protocol_map[protocol].upper()} flow"
-    chart_title = f"Flussi {protocol_map[protocol].upper()}, versione {document_map[document]}"
+    return {"xaxis_title": "time [mm:ss]",
+            "yaxis_title": f"{protocol_map[protocol].upper()} flow",
+            "chart_title": f"Flussi {protocol_map[protocol].upper()}, versione {document_map[document]}"}
 
-    data = data[data["cname"].isin(cnames)]
-    if data.empty:
-        return
+def layer4_key(root: str, stamp: tuple, protocol: Protocol, document: Document) -> str:
+    # stored timeline of every CNAME over the whole capture
+    return figure_key("layer4", stamp, root=root, protocol=protocol, document=document)
 
-    data = data.sort_values(by="c_port", ascending=False)
-    data["id"] = data.apply(lambda row: f"{row['c_ip']}:{row['c_port']}-{row['s_ip']}:{row['s_port']}", axis=1)
+def layer7_key(root: str, stamp: tuple) -> str:
+    return figure_key("layer7", stamp, root=root)
+
+def layer7_figure(hcom: pandas.DataFrame, meta: pandas.DataFrame, window: tuple[float, float] | None = None) -> go.Figure:
+    media = hcom[hcom["kind"].notna()]
+    return timeline_figure(data=media, meta=meta, xs="datetime_ts", xe="datetime_te", y="mime", color="mime",
+                           xaxis_title="time [mm:ss]", yaxis_title="mime", chart_title="HTTP transaction by MIME",
+                           hover=(Protocol.HTTP, Document.LOG_HAR_COMPLETE), window=window)
+
+def capture_span(meta: pandas.DataFrame | None, data: pandas.DataFrame) -> int:
+    # length of the capture (s), the whole of it is the default zoom window
+    end = data["te"].max() if meta is None else max(meta["rel"].max(), data["te"].max())
+    return int(numpy.ceil(end / 1000))
+
+def print_layer4_section(data: pandas.DataFrame, 
+                         meta: pandas.DataFrame, 
+                         protocol: Protocol, 
+                         document: Document, cnames: list[str], window: tuple[float, float]):
+    
+    xs, xe = "datetime_ts", "datetime_te"
+
+    with phase("filter"):
+        data = layer4_frame(data=data, protocol=protocol, document=document, cnames=cnames, window=window)
+    if data is None:
+        return
 
     __timeline(data=data, 
                meta=meta, 
@@ -78,76 +121,82 @@ def print_layer4_section(data: pandas.DataFrame,
                xe=xe, 
                y="id", 
                color="cname", 
-               xaxis_title=xaxis_title, 
-               yaxis_title=yaxis_title, 
-               chart_title=chart_title, info="info", legend=True, theme="streamlit")
+               **layer4_titles(protocol=protocol, document=document),
+               hover=(protocol, document), legend=True, theme="streamlit", window=window)
     
 
 
 def print_layer7_section(hcom: pandas.DataFrame,
-                         meta: pandas.DataFrame, acom: pandas.DataFrame, vcom: pandas.DataFrame):
+                         meta: pandas.DataFrame, acom: pandas.DataFrame, vcom: pandas.DataFrame,
+                         links: pandas.DataFrame | None = None, key: str | None = None,
+                         period: tuple[float, float] | None = None,
+                         tper: pandas.DataFrame | None = None, bins: dict | None = None):
     
     xs, xe = "datetime_ts", "datetime_te"
 
-    media = hcom[hcom["mime"].str.contains(r"audio|video|dash", na=False)]
+    media = hcom[hcom["kind"].notna()]
 
-    xaxis_title = "time [mm:ss]"
-    yaxis_title = "mime"
-    chart_title = "HTTP transaction by MIME"
+    fig = load_figure(key) if key is not None else None
+    if fig is None:
+        with phase("figure"):
+            fig = layer7_figure(hcom=hcom, meta=meta, window=period)
+    plotly_chart(fig, theme="streamlit", use_container_width=True)
     
-    __timeline(data=media, 
-               meta=meta, 
-               xs=xs, 
-               xe=xe, 
-               y="mime", 
-               color="mime", 
-               xaxis_title=xaxis_title,
-               yaxis_title=yaxis_title, 
-               chart_title=chart_title, 
-               info="info", 
-               legend=True, 
-               theme="streamlit")
-    
-    briefing = []
-    periods  = __extract_streaming_periods(frame=meta)
-    
-    for num, (ts, te) in enumerate(periods):
-        visit = media[(media['ts'] >= ts) & (media['ts'] <= te)]
-        
-        # calculate the number of requests for each MIME type
-        nvideo = len(visit[visit["mime"].str.contains(r"video", na=False)])
-        naudio = len(visit[visit["mime"].str.contains(r"audio", na=False)])
-        nmpd   = len(visit[visit["mime"].str.contains(r"dash", na=False)])
-        
-        # calculate the span of the period in seconds
-        span_s = int((te - ts) / 1000)
-        
-        # avoid division by zero for periods with zero span
-        if span_s > 0:
-            # calculate the frequency (requests per second)
-            freq_video = nvideo / span_s
-            freq_audio = naudio / span_s
-            freq_mpd   = nmpd   / span_s
-        else:
-            freq_video = freq_audio = freq_mpd = 0
-        
-        # append the information to the infos list
-        briefing.append({
-            "ts (s)": int(ts / 1000),          # start time in seconds
-            "te (s)": int(te / 1000),          # end time in seconds
-            "span (s)": span_s,                # time span in seconds
-            "# Video Requests": nvideo,        # total video requests
-            "# Audio Requests": naudio,        # total audio requests
-            "# MPD Requests": nmpd,            # total MPD requests (manifest)
-            "# Video Requests/s": freq_video,    # video requests per second
-            "# Audio Requests/s": freq_audio,    # audio requests per second
-            "# MPD Requests/s": freq_mpd         # MPD requests per second
-        })
+    # every transaction is bucketed into its streaming period at once
+    periods = __extract_streaming_periods(frame=meta)
+    if period is not None:
+        periods = [(ts, te) for ts, te in periods if te >= period[0] and ts <= period[1]]
+    with phase("filter"):
+        counts = period_counts(transactions={SERVER: hcom}, periods={SERVER: periods})
+
+    briefing = {
+        "ts (s)": (counts["ts"] / 1000).astype("int64"),    # start time in seconds
+        "te (s)": (counts["te"] / 1000).astype("int64"),    # end time in seconds
+        "span (s)": counts["span"],                         # time span in seconds
+        "# Video Requests": counts["video"],                # total video requests
+        "# Audio Requests": counts["audio"],                # total audio requests
+        "# MPD Requests": counts["mpd"],                    # total MPD requests (manifest)
+        "# Video Requests/s": counts["video_rate"],         # video requests per second
+        "# Audio Requests/s": counts["audio_rate"],         # audio requests per second
+        "# MPD Requests/s": counts["mpd_rate"],             # MPD requests per second
+    }
 
     # Display the DataFrame with the collected information in Streamlit
     streamlit.caption("#### Riepilogo")
     streamlit.dataframe(pandas.DataFrame(briefing), use_container_width=True, hide_index=True)
 
+    if links is not None:
+        # flows carrying media, looked up from the transaction to flow join
+        carried = links.loc[media.index].assign(kind=media["kind"]).dropna(subset=["flow"])
+        kinds   = pandas.crosstab(carried["flow"], carried["kind"]).reindex(columns=["video", "audio", "mpd"], fill_value=0)
+        flows   = carried.groupby("flow").first().join(kinds)
+
+        streamlit.caption("#### Flussi")
+        streamlit.dataframe(pandas.DataFrame({
+            "Flow": flows.index,
+            "Transport": flows["transport"].str.upper(),
+            "# Video Requests": flows["video"],
+            "# Audio Requests": flows["audio"],
+            "# MPD Requests": flows["mpd"],
+            "Client Bytes": flows["c_bytes_all"],
+            "Server Bytes": flows["s_bytes_all"],
+            "Client Retransmissions": flows["c_pkts_retx"],
+            "Server Retransmissions": flows["s_pkts_retx"],
+            "Client RTT (ms)": flows["c_rtt_avg"],
+            "Server RTT (ms)": flows["s_rtt_avg"],
+        }), use_container_width=True, hide_index=True)
+
+        # periodic bins of the TCP flow that carried a media request, while it was served
+        tcp = carried[carried["transport"] == "tcp"]
+        if tper is not None and bins is not None and len(tcp):
+            request = streamlit.selectbox("Select a media request", options=tcp.index,
+                                          format_func=lambda i: f"{media.at[i, 'kind']} at {media.at[i, 'ts'] / 1000:.1f}s "
+                                                                f"({str(media.at[i, 'url']).rsplit('/', 1)[-1]})")
+            data = transaction_bins(periodic=tper, bins=bins, flow=tcp.at[request, "flow"],
+                                    ts=media.at[request, "ts"], te=media.at[request, "te"])
+            streamlit.dataframe(data[["ts", "te", *LAYER4_COUNTERS[Protocol.TCP]]],
+                                use_container_width=True, hide_index=True)
+
 
 
     # col1, col2 = streamlit.columns(2)
@@ -181,99 +230,125 @@ def print_layer7_section(hcom: pandas.DataFrame,
     
         
     
-def get_number(name: str):
-    return int(name.split("-")[1]) if "-" in name else 0
-
-def load_data(path: str):
-    return pandas.read_csv(path, sep=" ") if os.path.exists(path) else None
-
-def process_tcp_logs(com: str, per: str):
-    global tcom, tper
-
-    tcom = load_data(path=com)
-    if tcom is not None:
-        format_layer(data=tcom, protocol=Protocol.TCP, document=Document.LOG_TCP_COMPLETE)
-
-    tper = load_data(path=per)
-    if tper is not None and tper["c_pkts_data"].any():
-        tper = tper[tper["c_pkts_data"] > 0]
-        format_layer(data=tper, protocol=Protocol.TCP, document=Document.LOG_TCP_PERIODIC)
+def select_period(meta: pandas.DataFrame | None) -> tuple[float, float] | None:
+    # streaming period (in ms) the sections load and plot, None for the whole capture
+    periods = __extract_streaming_periods(frame=meta) if meta is not None else []
+    # a period is named after the bot event opening it, e.g. radio-serie-a-on,
+    # at the even positions of the events delimiting the periods
+    events  = meta[~meta["event"].str.contains(BOT_EVENTS, case=False, na=False)]["event"] if periods else []
+    names   = [str(event).removesuffix("-on") for event in list(events)[0:2 * len(periods):2]]
+    choice  = streamlit.selectbox("Select streaming period", options=[None, *range(len(periods))],
+                                  format_func=lambda i: "whole capture" if i is None else
+                                  f"{names[i]} ({periods[i][0] / 1000:.0f}s - {periods[i][1] / 1000:.0f}s)")
+    return periods[choice] if choice is not None else None
+
+def select_window(label: str, meta: pandas.DataFrame | None, data: pandas.DataFrame,
+                  period: tuple[float, float] | None = None) -> tuple[float, float]:
+    # zoom window over the capture, or the period (in ms), a narrow window shows every bin
+    if period is None:
+        start, end = 0, capture_span(meta=meta, data=data)
+    else:
+        start, end = int(numpy.floor(period[0] / 1000)), int(numpy.ceil(period[1] / 1000))
+    ts, te = streamlit.slider(label, min_value=start, max_value=end, value=(start, end), format="%ds")
+    return ts * 1000, te * 1000
+
+@streamlit.fragment
+def __render_layer4(experiment: Experiment, protocol: Protocol, period: tuple[float, float] | None):
+    # one fragment per protocol: its widgets rerun only this section, and
+    # its logs are loaded only once the section is opened, over the period only
+    name = "TCP" if protocol is Protocol.TCP else "UDP"
+    complete, periodic = LAYER4[protocol]
+
+    if not streamlit.toggle(f"Show {name} flows", value=False):
+        return
 
-def process_udp_logs(com: str, per: str):
-    global ucom, uper
+    with fragment(f"{name} flows"):
+        meta = experiment.meta
+        com  = experiment.frame(complete, period)
+
+        # another period has other CNAMEs: the selected ones still among them are
+        # kept, and set again since new options make a new widget
+        key      = f"{name} cnames"
+        options  = set(com["cname"])
+        selected = streamlit.session_state.get(key, [])
+        missing  = [cname for cname in selected if cname not in options]
+        if missing:
+            streamlit.info(f"No {name} flows of {', '.join(missing)} in this period, unselected")
+        streamlit.session_state[key] = [cname for cname in selected if cname in options]
+
+        # CNAMEs of the CDNs serving linear content, labelled with their CDN and selectable at once
+        labelled = com[com["cdn"].notna()]
+        cdns = dict(zip(labelled["cname"].astype(str), labelled["cdn"].astype(str)))
+        if cdns and streamlit.button(f"Select the CDN CNAMEs over {name} flows"):
+            streamlit.session_state[key] = list(dict.fromkeys([*streamlit.session_state[key], *sorted(cdns)]))
+        tokens = streamlit.multiselect(f"Select CNAMEs over {name} flows", options, key=key,
+                                       format_func=lambda cname: f"{cname} ({cdns[cname]})" if cname in cdns else cname)
+
+        if tokens:
+            window = select_window(f"Zoom on {name} flows", meta=meta, data=com, period=period)
+            # every CNAME over the whole capture is served from the figure store, when rendered
+            stored = period is None and set(tokens) == set(com["cname"]) and \
+                     window == (0, capture_span(meta=meta, data=com) * 1000)
+            for doc in [complete, periodic]:
+                # a stored figure spares loading and filtering the log
+                key = layer4_key(root=experiment.root, stamp=experiment.stamp, protocol=protocol, document=doc)
+                fig = load_figure(key) if stored else None
+                if fig is not None:
+                    plotly_chart(fig, theme="streamlit", use_container_width=True)
+                    continue
+                print_layer4_section(data=experiment.frame(doc, period), meta=meta, protocol=protocol,
+                                     document=doc, cnames=tokens, window=window)
+        else:
+            streamlit.warning("You do not have selected any CNAME, nothing to see here")
 
-    ucom = load_data(path=com)
-    if ucom is not None:
-        format_layer(data=ucom, protocol=Protocol.UDP, document=Document.LOG_UDP_COMPLETE)
+@streamlit.fragment
+def __render_layer7(experiment: Experiment, period: tuple[float, float] | None):
+    if not streamlit.toggle("Show HTTP transactions", value=False):
+        return
 
-    uper = load_data(path=per)
-    if uper is not None:
-        format_layer(data=uper, protocol=Protocol.UDP, document=Document.LOG_UDP_PERIODIC)
-    
+    with fragment("HTTP transactions"):
+        hcom = experiment.frame(Document.LOG_HAR_COMPLETE, period)
+        if hcom is not None:
+            # the figure of the whole capture is stored, the ones of a period are not
+            key = layer7_key(root=experiment.root, stamp=experiment.stamp) if period is None else None
+            print_layer7_section(hcom=hcom, meta=experiment.meta,
+                                 vcom=experiment.frame(Document.LOG_VIDEO_COMPLETE, period),
+                                 acom=experiment.frame(Document.LOG_AUDIO_COMPLETE, period),
+                                 links=experiment.links(period), key=key, period=period,
+                                 tper=experiment.frame(Document.LOG_TCP_PERIODIC, period),
+                                 bins=experiment.bins(period))
 
 def __render():
     streamlit.html(os.path.join("www", SERVER, "__fst_section", "0.html"))
 
+    catalog = load_catalog(SERVER)
+
     col1, col2 = streamlit.columns(2)
 
     with col1:
-        qos = streamlit.selectbox("Choose testbed bandwidth", os.listdir(SERVER))
+        qos = streamlit.selectbox("Choose testbed bandwidth", catalog.rates())
 
     with col2:
-        opts = [opt for opt in os.listdir(os.path.join(SERVER, qos)) if opt.startswith("test")]
-        opts = sorted(opts, key=get_number)
+        opts = catalog.tests(qos)
         numb = streamlit.selectbox("Choose supervised experiment", options=opts[:LIMIT])
 
-    meta = None
-    
-    # Load logs
-    path = os.path.join(SERVER, qos, numb, LOG_BOT_COMPLETE)
-    bcom = load_data(path=path)
-    if bcom is not None:
-        key = "sniffer|browser|origin|net|app"
-        meta = bcom[~bcom["event"].str.contains(key, case=False, na=False)].reset_index(drop=True)
-
-    process_tcp_logs(
-        com=os.path.join(SERVER, qos, numb, LOG_TCP_COMPLETE),
-        per=os.path.join(SERVER, qos, numb, LOG_TCP_PERIODIC))
-
-    process_udp_logs(
-        com=os.path.join(SERVER, qos, numb, LOG_UDP_COMPLETE),
-        per=os.path.join(SERVER, qos, numb, LOG_UDP_PERIODIC))
+    # bot events only, every section loads its own logs (once per experiment)
+    experiment = load_experiment(server=SERVER, rate=qos, test=numb)
 
-    path = os.path.join(SERVER, qos, numb, LOG_HAR_COMPLETE)
-    hcom = load_data(path=path)
+    # the experiments likely to be opened next are loaded in the background
+    prefetch(server=SERVER, catalog=catalog, rate=qos, test=numb, tests=opts[:LIMIT])
 
-    path = os.path.join(SERVER, qos, numb, LOG_VIDEO_COMPLETE)
-    vcom = load_data(path=path)
-
-    path = os.path.join(SERVER, qos, numb, LOG_AUDIO_COMPLETE)
-    acom = load_data(path=path)
+    # the sections read only the rows of the chosen streaming period
+    period = select_period(meta=experiment.meta)
 
     # tcp section
     streamlit.html(os.path.join("www", SERVER, "__fst_section", "1.html"))
-    tcp_tokens = streamlit.multiselect("Select CNAMES over TCP flows", set(tcom["cname"]))
-
-    if tcp_tokens:
-        for log_data, doc in [(tcom, Document.LOG_TCP_COMPLETE), (tper, Document.LOG_TCP_PERIODIC)]:
-            print_layer4_section(data=log_data, meta=meta, protocol=Protocol.TCP, document=doc, cnames=tcp_tokens)
-    else:
-        streamlit.warning("You do not have selected any CNAME, nothing to see here")
+    __render_layer4(experiment=experiment, protocol=Protocol.TCP, period=period)
 
     # udp section
     streamlit.html(os.path.join("www", SERVER, "__fst_section", "2.html"))
-    udp_tokens = streamlit.multiselect("Select CNAMEs over UDP flows", set(ucom["cname"]))
-
-    if udp_tokens:
-        for log_data, doc in [(ucom, Document.LOG_UDP_COMPLETE), (uper, Document.LOG_UDP_PERIODIC)]:
-            print_layer4_section(data=log_data, meta=meta, protocol=Protocol.UDP, document=doc, cnames=udp_tokens)
-    else:
-        streamlit.warning("You do not have selected any CNAME, nothing to see here")
+    __render_layer4(experiment=experiment, protocol=Protocol.UDP, period=period)
 
     # http section
     streamlit.html(os.path.join("www", SERVER, "__fst_section", "3.html"))
-    if hcom is not None:
-        format_layer(data=hcom, protocol=Protocol.HTTP, document=Document.LOG_HAR_COMPLETE)
-        format_layer(data=vcom, protocol=Protocol.HTTP, document=Document.LOG_VIDEO_COMPLETE)
-        format_layer(data=acom, protocol=Protocol.HTTP, document=Document.LOG_AUDIO_COMPLETE)
-        print_layer7_section(hcom=hcom,  meta=meta,  vcom=vcom, acom=acom)
\ No newline at end of file
+    __render_layer7(experiment=experiment, period=period)
@@ -5,6 +5,9 @@ import plotly.express as px
 
 from lib.generic import OPACITY
 
+from lib.profiler import phase
+from lib.profiler import plotly_chart
+
 SERVER = "dazn"
 
 # file paths for the TCP and UDP CNAME data
@@ -100,21 +103,23 @@ def __render():
 
     tcp, udp = streamlit.columns(2)
     with tcp:
-        fig = px.bar(tcp_data, x='cname', y='probability')
-        fig.update_layout(xaxis_tickangle=-90, yaxis_title='frequency [%]')
-        fig.update_xaxes(showgrid=True)
-        fig.update_yaxes(showgrid=True)
-        fig.update_layout(xaxis_tickangle=-90)
-        fig.update_traces(opacity=OPACITY)
-        streamlit.plotly_chart(fig, use_container_width=True)
+        with phase("figure"):
+            fig = px.bar(tcp_data, x='cname', y='probability')
+            fig.update_layout(xaxis_tickangle=-90, yaxis_title='frequency [%]')
+            fig.update_xaxes(showgrid=True)
+            fig.update_yaxes(showgrid=True)
+            fig.update_layout(xaxis_tickangle=-90)
+            fig.update_traces(opacity=OPACITY)
+        plotly_chart(fig, use_container_width=True)
 
     with udp:
-        fig = px.bar(udp_data, x='cname', y='probability')
-        fig.update_layout(xaxis_tickangle=-90, yaxis_title='frequency [%]')
-        fig.update_xaxes(showgrid=True)
-        fig.update_yaxes(showgrid=True)
-        fig.update_layout(xaxis_tickangle=-90)
-        fig.update_traces(opacity=OPACITY)
-        streamlit.plotly_chart(fig, use_container_width=True)
+        with phase("figure"):
+            fig = px.bar(udp_data, x='cname', y='probability')
+            fig.update_layout(xaxis_tickangle=-90, yaxis_title='frequency [%]')
+            fig.update_xaxes(showgrid=True)
+            fig.update_yaxes(showgrid=True)
+            fig.update_layout(xaxis_tickangle=-90)
+            fig.update_traces(opacity=OPACITY)
+        plotly_chart(fig, use_container_width=True)
     create_briefing()
     streamlit.markdown("---")
\ No newline at end of file
@@ -1,17 +1,36 @@
 
-import os
 import pandas
 import numpy
 import streamlit
+import functools
 import concurrent.futures
+import plotly.graph_objects as go
 
 from lib.generic import TESTBED_RATES
 from lib.generic import LIMIT
 
 from lib.generic import Protocol
+from lib.generic import Document
 
-from lib.generic import __plot_scatter
-from lib.generic import __plot_trend
+from lib.generic import trend_figure
+from lib.generic import scatter_figure
+
+from lib.storage import read_log
+
+from lib.catalog import load_catalog
+
+from lib.aggregate import Aggregates
+
+from lib.rollup import STEPS
+from lib.rollup import COUNTERS
+from lib.rollup import rollup
+
+from lib.figures import figure_key
+from lib.figures import load_figure
+
+from lib.profiler import phase
+from lib.profiler import count
+from lib.profiler import plotly_chart
 
 # DAZN Section #3
 # This page contains the view-port on compiled Tstat traces, allowing the 
@@ -21,46 +40,113 @@ from lib.generic import __plot_trend
 
 SERVER = "dazn"
 
-@streamlit.cache_data(show_spinner=True, ttl=10_000)
+# output column -> (source column, whether zeros are ignored in the mean);
+# zeros mark bins without any media request, so request counts and rates
+# are averaged over the non-zero samples only
+COLUMNS = {
+    "audio_reqs": ("audio_reqs", True),
+    "video_reqs": ("video_reqs", True),
+    "audio_rate": ("avg_audio_rate", True),
+    "video_rate": ("avg_video_rate", True),
+    "c_bytes_all": ("c_bytes_all", False),
+    "s_bytes_all": ("s_bytes_all", False),
+    "c_packs_all": ("c_pkts_all", False),
+    "s_packs_all": ("s_pkts_all", False),
+    "avg_bin_duration": ("avg_bin_duration", False),
+    "max_bin_duration": ("max_bin_duration", False),
+    "min_bin_duration": ("min_bin_duration", False),
+}
+
+# columns of the steps without a media tree, only the traffic counters are rolled up exactly
+ROLLED = {column: (source, zeros) for column, (source, zeros) in COLUMNS.items() if source in COUNTERS}
+
+# steps of the slider; the ones without a media tree are rolled up from the
+# finest tree, so every step averages the same streaming periods, and must
+# be multiples of its step
+OPTIONS = ["1000", "2000", "3000", "5000", "10000", "15000", "20000", "30000", "60000"]
+
+# step shown when the page is opened
+DEFAULT = "5000"
+
+# charts of a protocol, by row and column: (figure, x, y, x axis title, y axis title, chart title)
+CHARTS = [
+    [[("trend", "ts", "s_bytes_all", "time [mm:ss]", "bytes [B]", "server bytes over time")],
+     [("trend", "ts", "c_bytes_all", "time [mm:ss]", "bytes [B]", "client bytes over time")]],
+    [[("trend", "ts", "video_rate", "time [mm:ss]", "rate [kbits]", "video quality over time"),
+      ("scatter", "s_bytes_all", "video_rate", "bytes [B]", "rate [kbits]", "server bytes vs video rate"),
+      ("scatter", "avg_bin_duration", "video_rate", "bytes [B]", "rate [kbits]", "server bytes vs audio rate")],
+     [("trend", "ts", "audio_rate", "time [mm:ss]", "rate [kbits]", "audio quality over time"),
+      ("scatter", "s_bytes_all", "audio_rate", "bytes [B]", "rate [kbits]", "server bytes vs audio rate"),
+      ("scatter", "avg_bin_duration", "audio_rate", "bytes [B]", "rate [kbits]", "server bytes vs audio rate")]],
+]
+
+# figures the charts are built with
+FIGURES = {"trend": trend_figure, "scatter": scatter_figure}
+
+# shared by every load, reading logs is mostly I/O and arrow conversions
+executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="load_samples")
+
+
+def step_columns(step: str) -> dict[str, tuple[str, bool]]:
+    return COLUMNS if step in STEPS else ROLLED
+
+def step_tree(step: str) -> str:
+    # media tree the samples of a step are read from, the finest one if the step has none
+    return step if step in STEPS else STEPS[0]
+
+def available(chart: tuple, step: str) -> bool:
+    _, x, y, *_ = chart
+    return {x, y} <= {"ts", *step_columns(step)}
+
+@streamlit.cache_resource(show_spinner=False)
+def media_aggregates(protocol: Protocol, rate: str, step: str) -> Aggregates:
+    # shared by every session and updated in place as experiments are added
+    return Aggregates(step_columns(step), [step])
+
+def summarize(path: str, document: Document, step: str) -> Aggregates:
+    frame = read_log(path, document)
+
+    # a step without a media tree is rolled up from the finest one
+    data = frame if step in STEPS else rollup(frame, [int(step)])[int(step)]
+
+    # the first bin is left out
+    aggregates = Aggregates(step_columns(step), [step])
+    aggregates[step].fold(data[data["ts"] != 0])
+    return aggregates
+
+def sample_signatures(rate: str, step: str, protocol: Protocol) -> dict[str, bytes]:
+    # files the samples of a rate are built from, with their signatures
+    document = Document.LOG_TCP_MEDIA if protocol is Protocol.TCP else Document.LOG_UDP_MEDIA
+    return load_catalog(SERVER).media(rate, "tcp" if protocol is Protocol.TCP else "udp", step_tree(step), document)
+
+def chart_keys(step: str, protocol: Protocol) -> dict[tuple, str]:
+    # keys of the stored charts of a protocol, built from the samples of every rate
+    inputs = {rate: sample_signatures(rate, step, protocol) for rate in TESTBED_RATES}
+    return {chart: figure_key("samples", inputs, step=step, protocol=protocol, chart=chart)
+            for row in CHARTS for column in row for chart in column if available(chart, step)}
+
 def load_samples(step: str, protocol: Protocol):
 
     samples = {}
 
+    document = Document.LOG_TCP_MEDIA if protocol is Protocol.TCP else Document.LOG_UDP_MEDIA
+
     # Loop over all available rates
     for rate in TESTBED_RATES:
-        root = os.path.join(SERVER, rate, "media", "tcp" if protocol is Protocol.TCP else "udp", step)
-        data = []
-
-        # Loop over all files in the root directory
-        for file in os.listdir(root):
-            path = os.path.join(root, file)
-            data.append(pandas.read_csv(path, sep=" "))
-
-        # Generate a frame from data (only first 10 files)
-        frame = pandas.concat(data[:25], ignore_index=True)
-
-        x = "ts"  # Timestamp column
-
-        # Group by 'ts' and calculate aggregates (ignoring 0 values)
-        data = (frame[frame[x] != 0]
-                .assign(**{x: frame[x] / 1000})  # Convert 'ts' from ms to seconds
-                .groupby(x, as_index=False)
-                .agg(
-                    audio_reqs=("audio_reqs", lambda x: x[x != 0].mean()),  # Mean ignoring 0 values
-                    video_reqs=("video_reqs", lambda x: x[x != 0].mean()),  # Mean ignoring 0 values
-                    audio_rate=("avg_audio_rate", lambda x: x[x != 0].mean()),  # Mean ignoring 0 values
-                    video_rate=("avg_video_rate", lambda x: x[x != 0].mean()),  # Mean ignoring 0 values
-                    c_bytes_all=("c_bytes_all", "mean"),  # Mean of client bytes (no filtering)
-                    s_bytes_all=("s_bytes_all", "mean"),  # Mean of server bytes (no filtering)
-                    c_packs_all=("c_pkts_all", "mean"),   # Mean of client bytes (no filtering)
-                    s_packs_all=("s_pkts_all", "mean"),   # Mean of server bytes (no filtering)
-                    avg_bin_duration=("avg_bin_duration", "mean"),   # Mean of client bytes (no filtering)
-                    max_bin_duration=("max_bin_duration", "mean"),   # Mean of server bytes (no filtering)
-                    min_bin_duration=("min_bin_duration", "mean")    # Mean of server bytes (no filtering)
-                ))
-
-        # Replace timestamps with datetime format
-        data[x] = pandas.to_datetime(data[x], origin="unix", unit='s')
+        signatures = sample_signatures(rate, step, protocol)
+        # Fold the files not seen yet into the running aggregates
+        aggregates = media_aggregates(protocol, rate, step)
+        summary    = functools.partial(summarize, document=document, step=step)
+
+        with phase("aggregate"):
+            folded = aggregates.update(signatures=signatures, summarize=summary, executor=executor)
+            count("media logs", calls=len(signatures), misses=folded)
+
+            x = "ts"  # Timestamp column
+            data = aggregates.frame(step)
+
+        # Replace timestamps (ms) with datetime format
+        data[x] = pandas.to_datetime(data[x] / 1000, origin="unix", unit='s')
 
         # Remove non-finite values (NaN, inf)
         data = data.replace([numpy.inf, -numpy.inf], numpy.nan).dropna()
@@ -71,66 +157,57 @@ def load_samples(step: str, protocol: Protocol):
     return samples
 
 
-def plot_protocol(protocol: Protocol, samples: dict):
+def chart_figure(chart: tuple, samples: dict) -> go.Figure:
+    figure, x, y, xaxis_title, yaxis_title, chart_title = chart
+    return FIGURES[figure](x=x, y=y, xaxis_title=xaxis_title, yaxis_title=yaxis_title,
+                           chart_title=chart_title, samples=samples)
+
+def plot_protocol(protocol: Protocol, step: str, samples: dict | None, figures: dict[tuple, go.Figure] | None = None):
+    # stored figures are shown as they are, the other charts are built from the samples;
+    # the charts of columns Tstat does not compute at the step are left out
 
     protocol = "TCP" if protocol is Protocol.TCP else "UDP"
     streamlit.caption(f"### {protocol}")
 
-    server, client = streamlit.columns(2)
-    with server:
-        __plot_trend(x="ts", y="s_bytes_all", 
-                   xaxis_title="time [mm:ss]", 
-                   yaxis_title="bytes [B]", 
-                   chart_title="server bytes over time", samples=samples)
-    with client:
-        __plot_trend(x="ts", y="c_bytes_all", 
-                   xaxis_title="time [mm:ss]", 
-                   yaxis_title="bytes [B]", 
-                   chart_title="client bytes over time", samples=samples)
-    video, audio = streamlit.columns(2)
-    with video:
-        __plot_trend(x="ts", y="video_rate", 
-                   xaxis_title="time [mm:ss]", 
-                   yaxis_title="rate [kbits]", 
-                   chart_title="video quality over time", samples=samples)
-        __plot_scatter(x="s_bytes_all", y="video_rate", 
-                     xaxis_title="bytes [B]",
-                     yaxis_title="rate [kbits]", 
-                     chart_title="server bytes vs video rate", samples=samples)
-        __plot_scatter(x="avg_bin_duration", y="video_rate", 
-                     xaxis_title="bytes [B]",
-                     yaxis_title="rate [kbits]", 
-                     chart_title="server bytes vs audio rate", samples=samples)
-    with audio:
-        __plot_trend(x="ts", y="audio_rate", 
-                   xaxis_title="time [mm:ss]", 
-                   yaxis_title="rate [kbits]", 
-                   chart_title="audio quality over time", samples=samples)
-        __plot_scatter(x="s_bytes_all", y="audio_rate", 
-                     xaxis_title="bytes [B]",
-                     yaxis_title="rate [kbits]", 
-                     chart_title="server bytes vs audio rate", samples=samples)
-        __plot_scatter(x="avg_bin_duration", y="audio_rate", 
-                     xaxis_title="bytes [B]",
-                     yaxis_title="rate [kbits]", 
-                     chart_title="server bytes vs audio rate", samples=samples)
+    if step not in STEPS:
+        streamlit.info(f"At a {int(step) // 1000}s step only the traffic is shown, rolled up from the "
+                       f"{int(STEPS[0]) // 1000}s bins: Tstat computes rates and bin durations at "
+                       f"{', '.join(f'{int(tree) // 1000}s' for tree in STEPS)} only")
+
+    figures = figures or {}
+    for row in CHARTS:
+        for place, column in zip(streamlit.columns(len(row)), row):
+            with place:
+                for chart in column:
+                    if not available(chart, step):
+                        continue
+                    fig = figures.get(chart)
+                    if fig is None:
+                        with phase("figure"):
+                            fig = chart_figure(chart, samples)
+                    plotly_chart(fig, use_container_width=True)
 
 
 def main():
 
     samples = load_samples(step="5000", protocol=Protocol.TCP)
-    plot_protocol(protocol=Protocol.TCP, samples=samples)
+    plot_protocol(protocol=Protocol.TCP, step="5000", samples=samples)
 
     samples = load_samples(step="5000", protocol=Protocol.UDP)
-    plot_protocol(protocol=Protocol.UDP, samples=samples)
+    plot_protocol(protocol=Protocol.UDP, step="5000", samples=samples)
 
 
 
 
 def __render():
 
-    samples = load_samples(step="5000", protocol=Protocol.TCP)
-    plot_protocol(protocol=Protocol.TCP, samples=samples)
+    # Aggregates are kept in memory, switching back to a step reads no log;
+    # steps without a media tree are rolled up from the finest one the first time
+    step = streamlit.select_slider("Step", options=OPTIONS, value=DEFAULT,
+                                   format_func=lambda step: f"{int(step) // 1000}s")
 
-    samples = load_samples(step="5000", protocol=Protocol.UDP)
-    plot_protocol(protocol=Protocol.UDP, samples=samples)
+    for protocol in [Protocol.TCP, Protocol.UDP]:
+        # the samples are loaded only if some chart of the protocol is not stored
+        figures = {chart: load_figure(key) for chart, key in chart_keys(step, protocol).items()}
+        samples = None if all(fig is not None for fig in figures.values()) else load_samples(step=step, protocol=protocol)
+        plot_protocol(protocol=protocol, step=step, samples=samples, figures=figures)
@@ -0,0 +1,143 @@
+import os
+import functools
+import dataclasses
+import pandas
+
+from lib.generic import Protocol
+from lib.generic import Document
+
+from lib.generic import LOG_BOT_COMPLETE
+from lib.generic import LOG_HAR_COMPLETE
+from lib.generic import LOG_TCP_COMPLETE
+from lib.generic import LOG_UDP_COMPLETE
+from lib.generic import LOG_TCP_PERIODIC
+from lib.generic import LOG_UDP_PERIODIC
+from lib.generic import LOG_AUDIO_COMPLETE
+from lib.generic import LOG_VIDEO_COMPLETE
+
+from lib.generic import format_layer
+from lib.generic import BOT_EVENTS
+from lib.generic import LAYER4_COUNTERS
+
+from lib.storage import read_log
+
+from lib.catalog import load_catalog
+
+from lib.profiler import phase
+
+from lib.memory import fetch
+
+from lib.join import flow_bins
+from lib.join import join_flows
+
+# Experiment loader
+# An experiment is the set of logs of one dazn/<rate>/test-N folder. Every
+# log is loaded and formatted the first time it is asked for, so a section
+# only pays for its own logs, then shared by every rerun and every session
+# through the shared memory cache (lib.memory), which evicts the least
+# recently used logs beyond its budget. Entries are keyed by the stamp of
+# the experiment, so a change to any of its files loads it again. A log can
+# be loaded over a time window only (a streaming period), reading just the
+# rows overlapping it (lib.storage).
+
+# logs of an experiment, with the protocol used to format them
+DOCUMENTS = {
+    Document.LOG_TCP_COMPLETE:   (LOG_TCP_COMPLETE,   Protocol.TCP),
+    Document.LOG_TCP_PERIODIC:   (LOG_TCP_PERIODIC,   Protocol.TCP),
+    Document.LOG_UDP_COMPLETE:   (LOG_UDP_COMPLETE,   Protocol.UDP),
+    Document.LOG_UDP_PERIODIC:   (LOG_UDP_PERIODIC,   Protocol.UDP),
+    Document.LOG_HAR_COMPLETE:   (LOG_HAR_COMPLETE,   Protocol.HTTP),
+    Document.LOG_VIDEO_COMPLETE: (LOG_VIDEO_COMPLETE, Protocol.HTTP),
+    Document.LOG_AUDIO_COMPLETE: (LOG_AUDIO_COMPLETE, Protocol.HTTP),
+}
+
+# columns of the flow logs read by the dashboard (timelines, hover, join),
+# the others are never loaded; every column of the HTTP logs is
+FLOW_COLUMNS = ["id", "ts", "te", "c_ip", "c_port", "s_ip", "s_port", "cname", "cdn"]
+COLUMNS = {
+    Document.LOG_TCP_COMPLETE: FLOW_COLUMNS + LAYER4_COUNTERS[Protocol.TCP] + ["c_first", "s_first", "c_rtt_avg", "s_rtt_avg"],
+    Document.LOG_TCP_PERIODIC: FLOW_COLUMNS + LAYER4_COUNTERS[Protocol.TCP],
+    Document.LOG_UDP_COMPLETE: FLOW_COLUMNS + LAYER4_COUNTERS[Protocol.UDP],
+    Document.LOG_UDP_PERIODIC: FLOW_COLUMNS + LAYER4_COUNTERS[Protocol.UDP],
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class Experiment:
+    root: str
+    rate: str
+    test: str
+    stamp: tuple
+    meta: pandas.DataFrame | None
+
+    def frame(self, document: Document, window: tuple[float, float] | None = None) -> pandas.DataFrame | None:
+        # sessions share the log, it is loaded by the first one asking
+        name, protocol = DOCUMENTS[document]
+        return fetch("log", (self.root, self.stamp, document, window),
+                     functools.partial(load_document, path=os.path.join(self.root, name), protocol=protocol,
+                                       document=document, columns=COLUMNS.get(document), window=window))
+
+    def links(self, window: tuple[float, float] | None = None) -> pandas.DataFrame | None:
+        # flow carrying each HTTP transaction, joined once per experiment and window
+        return fetch("links", (self.root, self.stamp, window), functools.partial(self.__join, window))
+
+    def bins(self, window: tuple[float, float] | None = None) -> dict:
+        # positions of the periodic bins of every TCP flow, in the periodic log of the same window
+        return fetch("bins", (self.root, self.stamp, window),
+                     lambda: flow_bins(self.frame(Document.LOG_TCP_PERIODIC, window)))
+
+    def __join(self, window: tuple[float, float] | None) -> pandas.DataFrame | None:
+        hcom = self.frame(Document.LOG_HAR_COMPLETE, window)
+        if hcom is None:
+            return None
+        with phase("join"):
+            return join_flows(hcom, self.frame(Document.LOG_TCP_COMPLETE, window),
+                              self.frame(Document.LOG_UDP_COMPLETE, window))
+
+
+def experiment_stamp(server: str, rate: str, test: str) -> tuple:
+    stamp = []
+    for name in sorted(os.listdir(os.path.join(server, rate, test))):
+        stat = os.stat(os.path.join(server, rate, test, name))
+        stamp.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(stamp)
+
+def load_meta(path: str) -> pandas.DataFrame | None:
+    bcom = read_log(path, Document.LOG_BOT_COMPLETE)
+    if bcom is None:
+        return None
+    return bcom[~bcom["event"].str.contains(BOT_EVENTS, case=False, na=False)].reset_index(drop=True)
+
+def load_document(path: str, protocol: Protocol, document: Document,
+                  columns: list[str] | None = None, window: tuple[float, float] | None = None) -> pandas.DataFrame | None:
+    data = read_log(path, document, columns, window)
+    if data is None:
+        return None
+
+    # periodic tcp bins without data are of no interest
+    if document == Document.LOG_TCP_PERIODIC:
+        if not data["c_pkts_data"].any():
+            return data
+        data = data[data["c_pkts_data"] > 0].copy()
+
+    with phase("format_layer"):
+        format_layer(data=data, protocol=protocol, document=document)
+    return data
+
+def __load_experiment(server: str, rate: str, test: str, stamp: tuple) -> Experiment:
+    root = os.path.join(server, rate, test)
+
+    # logs are loaded on demand, see Experiment.frame
+    meta = load_meta(path=os.path.join(root, LOG_BOT_COMPLETE))
+    return Experiment(root=root, rate=rate, test=test, stamp=stamp, meta=meta)
+
+def open_experiment(server: str, rate: str, test: str, stamp: tuple) -> Experiment:
+    # the stamp is part of the cache key, so a change to any file of
+    # the experiment reloads it instead of serving stale frames
+    return fetch("experiment", (server, rate, test, stamp),
+                 functools.partial(__load_experiment, server, rate, test, stamp))
+
+def load_experiment(server: str, rate: str, test: str) -> Experiment:
+    stamp = load_catalog(server).stamp(rate=rate, test=test)
+    with phase("load"):
+        return open_experiment(server, rate, test, stamp)
@@ -0,0 +1,81 @@
+import os
+import json
+import tempfile
+import hashlib
+import plotly
+import plotly.io
+import plotly.graph_objects as go
+
+from typing import Any
+
+from lib.storage import CACHE
+
+from lib.profiler import phase
+from lib.profiler import count
+
+# Pre-rendered figure store
+# Figures whose inputs only change between test campaigns are rendered
+# offline (lib.prerender) and stored as plotly JSON, one file per figure,
+# named after the hash of everything the figure is built from: the stamps
+# of the logs it reads, the parameters of the chart, the version of plotly
+# and the version of the figures below. A figure is looked up by hashing
+# its inputs, so a stored figure is never stale, and a figure whose inputs
+# have not changed is never rendered again. The dashboard serves a stored
+# figure when there is one, and renders it live otherwise. A figure without
+# any data is stored empty, so that it is not rendered again either.
+
+STORE = os.path.join(CACHE, "figures")
+
+# bump whenever the figures built from the same inputs change
+VERSION = 2
+
+
+def figure_key(name: str, inputs: Any, **params) -> str:
+    # hash of the inputs of a figure; bytes, enums and the like by their repr
+    text = json.dumps([VERSION, plotly.__version__, name, inputs, params], sort_keys=True, default=repr)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def figure_path(key: str) -> str:
+    return os.path.join(STORE, key[:2], f"{key}.json")
+
+def has_figure(key: str) -> bool:
+    return os.path.exists(figure_path(key))
+
+def load_figure(key: str) -> go.Figure | None:
+    path = figure_path(key)
+    if not os.path.exists(path):
+        count("figure store", misses=1)
+        return None
+    try:
+        with phase("figure store"):
+            with open(path) as file:
+                text = file.read()
+            fig = plotly.io.from_json(text) if text != "null" else None
+    except (OSError, ValueError):
+        count("figure store", misses=1)
+        return None
+    count("figure store")
+    return fig
+
+def store_figure(key: str, fig: go.Figure | None):
+    path = figure_path(key)
+    # write to a temporary file of its own first, readers never see half a figure
+    temp = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path), suffix=".tmp")
+        with os.fdopen(handle, "w") as file:
+            file.write(fig.to_json() if fig is not None else "null")
+        os.replace(temp, path)
+    except OSError:
+        if temp is not None and os.path.exists(temp):
+            os.remove(temp)
+
+def stored_keys() -> set[str]:
+    # keys of every stored figure
+    keys = set()
+    if os.path.isdir(STORE):
+        for folder in os.listdir(STORE):
+            keys.update(name[:-len(".json")] for name in os.listdir(os.path.join(STORE, folder))
+                        if name.endswith(".json"))
+    return keys
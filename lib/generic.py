@@ -1,15 +1,24 @@
+import os
+import re
 import enum
 import pandas
-import streamlit
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy
 
+from lib.profiler import phase
+from lib.profiler import plotly_chart
+
 
 TEMPLATE = None
 OPACITY  = 1.0
 LIMIT    = 30
 
+# level of detail of timelines: at most SHAPES bars are sent to the browser,
+# and bins of the same flow closer than one of PIXELS columns are merged
+SHAPES   = 1000
+PIXELS   = 1200
+
 # enum for different log document types
 class Document(enum.Enum):
     LOG_TCP_COMPLETE = 1
@@ -20,6 +29,9 @@ class Document(enum.Enum):
     LOG_STM_COMPLETE = 6
     LOG_VIDEO_COMPLETE = 7
     LOG_AUDIO_COMPLETE = 8
+    LOG_BOT_COMPLETE = 9
+    LOG_TCP_MEDIA = 10
+    LOG_UDP_MEDIA = 11
 
 # enum for different protocols
 class Protocol(enum.Enum):
@@ -40,6 +52,9 @@ LOG_VIDEO_COMPLETE = "log_video_complete"
 # restbed bitrate conditions
 TESTBED_RATES = ["1.5Mbps", "3Mbps", "4.5Mbps", "6Mbps", "7.5Mbps", "50Mbps"]
 
+# bot events which do not delimit a streaming period
+BOT_EVENTS = "sniffer|browser|origin|net|app"
+
 # colors associated with testbed rates
 TESTBED_RATES_COLORS = [
     '#8B0000',   # dark red
@@ -87,70 +102,217 @@ def timeline_axis(min_value, max_value):
     return values, labels
 
 
-def __layer4_timeline_info(record: dict, protocol: Protocol, document: Document) -> str:
-    text = ""
+def get_number(name: str):
+    return int(name.split("-")[1]) if "-" in name else 0
+
+def fmt_columns(template: str, *columns) -> numpy.ndarray:
+    # fill a str.format template over whole columns at once
+    columns = [c.to_numpy(dtype=object) if isinstance(c, pandas.Series) else c for c in columns]
+    return numpy.frompyfunc(template.format, len(columns), 1)(*columns)
+
+def fmt_flow_ids(data: pandas.DataFrame) -> pandas.Series:
+    text = fmt_columns("{}:{}-{}:{}", data["c_ip"], data["c_port"], data["s_ip"], data["s_port"])
+    return pandas.Series(text, index=data.index, dtype=object)
+
+
+# Hover of the timelines
+# Points carry only their raw values as customdata, mostly numbers, and the
+# labels live in one hovertemplate per trace, formatted by plotly in the
+# browser. Templates name their fields as {field} or {field:format}; the text
+# shared by all the points of a trace (the cname of a flow, the scheme and
+# host of the urls) is moved from customdata into the template of the trace.
+
+def hover_values(values: numpy.ndarray) -> numpy.ndarray:
+    # the float nearest to the {:.2f} text of each value, which plotly's .2f
+    # prints back as is; rounding numerically rounds twice, and the browser
+    # rounds exact ties (e.g. 0.125) up where python rounds them to even
+    return fmt_columns("{:.2f}", values).astype(float)
+
+def split_volumes(volumes: pandas.Series) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # value and unit of fmt_volume, column-wise
+    values = volumes.to_numpy(dtype=float)
+    units  = numpy.full(len(values), "", dtype=object)
+    todo   = numpy.ones(len(values), dtype=bool)
+
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        done = todo & (values < 1024)
+        units[done] = unit
+        todo &= ~done
+        values = numpy.where(done | ~todo, values, values / 1024)
+
+    return hover_values(values), units
+
+def split_timestamps(timestamps: pandas.Series) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # seconds and milliseconds of fmt_timestamp, column-wise
+    values = timestamps.to_numpy(dtype=float)
+    return numpy.floor_divide(values, 1000), hover_values(numpy.mod(values, 1000))
+
+def __layer4_timeline_hover(data: pandas.DataFrame, protocol: Protocol, document: Document) -> tuple[str, dict]:
+    fields = {}
+    fields["c_bytes"], fields["c_unit"] = split_volumes(data["c_bytes_all"])
+    fields["s_bytes"], fields["s_unit"] = split_volumes(data["s_bytes_all"])
+    fields["ts_s"], fields["ts_ms"] = split_timestamps(data["ts"])
+    fields["te_s"], fields["te_ms"] = split_timestamps(data["te"])
 
     if protocol == Protocol.TCP:
         # format text for tcp timeline information
-        text += (
-            f"<b>CNAME</b> <br> {record['cname']} (TCP)<br>"
-            f"<br>"
-            f"<b>packets (client/server)</b><br>"
-            f"  <b>pkts (data)</b> {record['c_pkts_data']} / {record['s_pkts_data']}<br>"
-            f"  <b>ack pkts (pure)</b> {record['c_ack_cnt_p']} / {record['s_ack_cnt_p']}<br>"
-            f"  <b>ack pkts (data)</b> {record['c_ack_cnt']} / {record['s_ack_cnt']}<br>"
-            f"  <b>xmit  pkts</b> {record['c_pkts_all']} / {record['s_pkts_all']}<br>"
-            f"  <b>rxmit pkts</b> {record['c_pkts_retx']} / {record['s_pkts_retx']}<br>"
-            f"<br>"
-            f"<b>bytes (client/server)</b><br>"
-            f"  <b>bytes</b> {fmt_volume(record['c_bytes_all'])} / {fmt_volume(record['s_bytes_all'])}<br>"
-            f"<br>"
-            f"<b>timings</b><br>"
-            f"<b>ts</b>  {fmt_timestamp(record['ts'])}<br>"
-            f"<b>te</b>  {fmt_timestamp(record['te'])}<br>")
+        template = ("<b>CNAME</b> <br> {cname} (TCP)<br>"
+                    "<br>"
+                    "<b>packets (client/server)</b><br>"
+                    "  <b>pkts (data)</b> {c_pkts_data} / {s_pkts_data}<br>"
+                    "  <b>ack pkts (pure)</b> {c_ack_cnt_p} / {s_ack_cnt_p}<br>"
+                    "  <b>ack pkts (data)</b> {c_ack_cnt} / {s_ack_cnt}<br>"
+                    "  <b>xmit  pkts</b> {c_pkts_all} / {s_pkts_all}<br>"
+                    "  <b>rxmit pkts</b> {c_pkts_retx} / {s_pkts_retx}<br>"
+                    "<br>"
+                    "<b>bytes (client/server)</b><br>"
+                    "  <b>bytes</b> {c_bytes:.2f} {c_unit} / {s_bytes:.2f} {s_unit}<br>"
+                    "<br>"
+                    "<b>timings</b><br>"
+                    "<b>ts</b>  {ts_s:.2f}s {ts_ms:.2f}ms<br>"
+                    "<b>te</b>  {te_s:.2f}s {te_ms:.2f}ms<br>")
+        for column in ["c_pkts_data", "s_pkts_data", "c_ack_cnt_p", "s_ack_cnt_p", "c_ack_cnt", "s_ack_cnt",
+                       "c_pkts_all", "s_pkts_all", "c_pkts_retx", "s_pkts_retx"]:
+            fields[column] = data[column].to_numpy()
 
         if document == Document.LOG_TCP_COMPLETE:
             # add additional details for complete log
-            text += (
-                f"<b>first pkt with data (client)</b>  {fmt_timestamp(record['ts'] + record['c_first'])}<br>"
-                f"<b>first pkt with data (server)</b>  {fmt_timestamp(record['ts'] + record['s_first'])}<br>")
-            
+            template += ("<b>first pkt with data (client)</b>  {cf_s:.2f}s {cf_ms:.2f}ms<br>"
+                         "<b>first pkt with data (server)</b>  {sf_s:.2f}s {sf_ms:.2f}ms<br>")
+            fields["cf_s"], fields["cf_ms"] = split_timestamps(data["ts"] + data["c_first"])
+            fields["sf_s"], fields["sf_ms"] = split_timestamps(data["ts"] + data["s_first"])
 
     if protocol == Protocol.UDP:
         # format text for udp timeline information
-        text += (
-            f"<b>CNAME</b> <br> {record['cname']} (UDP)<br>"
-            f"<br>"
-            f"<b>packets (client/server)</b><br>"
-            f"  <b>pkts</b> {record['c_pkts_all']} / {record['s_pkts_all']}<br>"
-            f"<br>"
-            f"<b>bytes (client/server)</b><br>"
-            f"  <b>bytes</b> {fmt_volume(record['c_bytes_all'])} / {fmt_volume(record['s_bytes_all'])}<br>"
-            f"<br>"
-            f"<b>timings</b><br>"
-            f"<b>ts</b>  {fmt_timestamp(record['ts'])}<br>"
-            f"<b>te</b>  {fmt_timestamp(record['te'])}<br>"
-            f"<br>")
-    
-    return text
-
-def __layer7_timeline_info(record: dict) -> str:
-    return (
-        f"<b>transaction</b> <br> {record['method']} {record['url']}<br>"
-        f"<br>"
-        f"<b>ts</b> {fmt_timestamp(record['ts'])}<br>"
-        f"<b>te</b> {fmt_timestamp(record['te'])}<br>"
-        f"<b>connection</b> {record['connection']}<br>")
-
-
-def __timeline(data: pandas.DataFrame | None, 
-               meta: pandas.DataFrame | None, 
-               xs: str, 
-               xe: str, y: str, 
-               color: str,
-               xaxis_title: str,
-               yaxis_title: str,
-               chart_title: str, info: str | None, legend=True, theme=None, log_scale=None):
+        template = ("<b>CNAME</b> <br> {cname} (UDP)<br>"
+                    "<br>"
+                    "<b>packets (client/server)</b><br>"
+                    "  <b>pkts</b> {c_pkts_all} / {s_pkts_all}<br>"
+                    "<br>"
+                    "<b>bytes (client/server)</b><br>"
+                    "  <b>bytes</b> {c_bytes:.2f} {c_unit} / {s_bytes:.2f} {s_unit}<br>"
+                    "<br>"
+                    "<b>timings</b><br>"
+                    "<b>ts</b>  {ts_s:.2f}s {ts_ms:.2f}ms<br>"
+                    "<b>te</b>  {te_s:.2f}s {te_ms:.2f}ms<br>"
+                    "<br>")
+        for column in ["c_pkts_all", "s_pkts_all"]:
+            fields[column] = data[column].to_numpy()
+
+    fields["cname"] = data["cname"].astype(str).to_numpy(dtype=object)
+    return template, fields
+
+def __layer7_timeline_hover(data: pandas.DataFrame) -> tuple[str, dict]:
+    template = ("<b>transaction</b> <br> {method} {url}<br>"
+                "<br>"
+                "<b>ts</b> {ts_s:.2f}s {ts_ms:.2f}ms<br>"
+                "<b>te</b> {te_s:.2f}s {te_ms:.2f}ms<br>"
+                "<b>connection</b> {connection}<br>")
+    fields = {"method": data["method"].astype(str).to_numpy(dtype=object),
+              "url": data["url"].astype(str).to_numpy(dtype=object),
+              "connection": data["connection"].to_numpy()}
+    fields["ts_s"], fields["ts_ms"] = split_timestamps(data["ts"])
+    fields["te_s"], fields["te_ms"] = split_timestamps(data["te"])
+    return template, fields
+
+def timeline_hover(data: pandas.DataFrame, protocol: Protocol, document: Document) -> tuple[str, dict]:
+    # hover template and fields of the rows of a timeline
+    if protocol in {Protocol.TCP, Protocol.UDP}:
+        return __layer4_timeline_hover(data=data, protocol=protocol, document=document)
+    return __layer7_timeline_hover(data=data)
+
+def hover_traces(fig: go.Figure, data: pandas.DataFrame, color: str, template: str, fields: dict):
+    # customdata and hovertemplate of every trace, px makes one trace per color
+    groups = data.groupby(data[color].astype(str), sort=False, observed=True).indices
+    names  = list(fields)
+
+    for trace in fig.data:
+        rows     = groups[trace.name]
+        values   = []
+        prefixes = {}
+        for name in names:
+            column = fields[name][rows]
+            if column.dtype == object:
+                # text shared by every point of the trace goes in the template, up to
+                # the first character plotly would read as part of a placeholder
+                prefix = re.split(r"[%{}]", os.path.commonprefix(list(column)))[0]
+                column = numpy.array([value[len(prefix):] for value in column], dtype=object)
+                prefixes[name] = (prefix, any(column))
+            values.append(column)
+
+        def placeholder(match: re.Match) -> str:
+            name = match.group(1)
+            data = f"%{{customdata[{names.index(name)}]{match.group(2) or ''}}}"
+            if name not in prefixes:
+                # numbers are formatted by plotly
+                return data
+            prefix, rest = prefixes[name]
+            return prefix + (data if rest else "")
+
+        # a single pass, so the text moved into the template is never read as a field
+        text = re.sub(r"\{(\w+)(:[^}]*)?\}", placeholder, template)
+        trace.update(hovertemplate=text, customdata=numpy.column_stack(values))
+
+
+# counters summed when adjacent periodic bins are merged
+LAYER4_COUNTERS = {
+    Protocol.TCP: ["c_pkts_data", "s_pkts_data", "c_ack_cnt_p", "s_ack_cnt_p", "c_ack_cnt", "s_ack_cnt",
+                   "c_pkts_all", "s_pkts_all", "c_pkts_retx", "s_pkts_retx", "c_bytes_all", "s_bytes_all"],
+    Protocol.UDP: ["c_pkts_all", "s_pkts_all", "c_bytes_all", "s_bytes_all"],
+}
+
+
+def format_layer(data: pandas.DataFrame, protocol: Protocol, document: Document):
+
+    ts, te = "ts", "te"
+    data[f"datetime_{ts}"] = pandas.to_datetime(data[ts], unit="ms", origin="unix")
+    data[f"datetime_{te}"] = pandas.to_datetime(data[te], unit="ms", origin="unix")
+
+
+def __level_of_detail(data: pandas.DataFrame,
+                      y: str,
+                      xs: str,
+                      xe: str,
+                      sums: list[str],
+                      window: tuple[float, float], shapes: int = SHAPES, pixels: int = PIXELS) -> pandas.DataFrame:
+
+    # merge the bins of a flow falling in the same pixel column of the window,
+    # widening the columns until no more than `shapes` segments are left
+    flows, _ = pandas.factorize(data[y])
+    starts   = data[xs].to_numpy(dtype=float) - window[0]
+    width    = max((window[1] - window[0]) / pixels, 1.0)
+
+    while True:
+        # bins starting before the window belong to its first column
+        columns  = numpy.maximum(numpy.floor_divide(starts, width).astype(numpy.int64), 0)
+        segments = flows * (columns.max(initial=0) + 1) + columns
+        # a single column per flow cannot be merged any further
+        if len(numpy.unique(segments)) <= shapes or columns.max(initial=0) == 0:
+            break
+        width *= 2
+
+    # nothing to merge, every bin is already a segment
+    if len(numpy.unique(segments)) == len(data):
+        return data.assign(bins=1)
+
+    aggs = {column: "first" for column in data.columns}
+    aggs.update({column: "sum" for column in sums})
+    aggs.update({xs: "min", xe: "max"})
+
+    merged = data.groupby(segments, sort=False).agg(aggs)
+    merged["bins"] = data.groupby(segments, sort=False).size()
+    return merged.reset_index(drop=True)
+
+
+def timeline_figure(data: pandas.DataFrame | None, 
+                    meta: pandas.DataFrame | None, 
+                    xs: str, 
+                    xe: str, y: str, 
+                    color: str,
+                    xaxis_title: str,
+                    yaxis_title: str,
+                    chart_title: str, hover: tuple[Protocol, Document] | None, legend=True, log_scale=None,
+                    window: tuple[float, float] | None = None) -> go.Figure:
     
     # generate a timeline figure
     fig = px.timeline(data_frame=data, 
@@ -158,12 +320,12 @@ def __timeline(data: pandas.DataFrame | None,
                       x_end=xe, 
                       y=y, 
                       color=color, 
-                      custom_data=[info] if info else None, 
                       template=TEMPLATE)
 
-    # add hover description
-    if info:
-        fig.update_traces(hovertemplate="%{customdata[0]}")
+    # add hover description, (protocol, document) of the rows
+    if hover:
+        template, fields = timeline_hover(data=data, protocol=hover[0], document=hover[1])
+        hover_traces(fig=fig, data=data, color=color, template=template, fields=fields)
 
     # configure x-axis
     if meta is not None:
@@ -184,14 +346,14 @@ def __timeline(data: pandas.DataFrame | None,
                      showgrid=True)
     fig.update_yaxes(tickfont=dict(size=12), title=yaxis_title, showgrid=True)
 
+    # zoom on the requested window (in ms)
+    if window is not None:
+        fig.update_xaxes(range=list(pandas.to_datetime(window, unit="ms", origin="unix")))
+
     # set trace opacity and title
     fig.update_traces(opacity=OPACITY)
     fig.update_layout(title=chart_title, title_font=dict(size=12), showlegend=legend)
 
-    # show the plot if no metadata
-    if meta is None:
-        streamlit.plotly_chart(fig, theme=theme, use_container_width=True)
-
     # add metadata plot rectangles
     if meta is not None:
         for i in range(0, len(meta) - 1, 2):
@@ -202,14 +364,31 @@ def __timeline(data: pandas.DataFrame | None,
                           line_width=0, 
                           annotation_position="bottom right")
 
+    return fig
+
+def __timeline(data: pandas.DataFrame | None, 
+               meta: pandas.DataFrame | None, 
+               xs: str, 
+               xe: str, y: str, 
+               color: str,
+               xaxis_title: str,
+               yaxis_title: str,
+               chart_title: str, hover: tuple[Protocol, Document] | None, legend=True, theme=None, log_scale=None,
+               window: tuple[float, float] | None = None):
+
+    with phase("figure"):
+        fig = timeline_figure(data=data, meta=meta, xs=xs, xe=xe, y=y, color=color,
+                              xaxis_title=xaxis_title, yaxis_title=yaxis_title, chart_title=chart_title,
+                              hover=hover, legend=legend, log_scale=log_scale, window=window)
+
     # show the plot
-    streamlit.plotly_chart(fig, theme=theme, use_container_width=True)
+    plotly_chart(fig, theme=theme, use_container_width=True)
 
 
-def __plot_trend(x: str, y: str, 
-               xaxis_title: str, 
-               yaxis_title: str, 
-               chart_title: str, samples: dict):
+def trend_figure(x: str, y: str, 
+                 xaxis_title: str, 
+                 yaxis_title: str, 
+                 chart_title: str, samples: dict) -> go.Figure:
 
     fig = go.Figure()
 
@@ -224,12 +403,22 @@ def __plot_trend(x: str, y: str,
     fig.update_xaxes(tickfont=dict(size=12), title=xaxis_title, showgrid=True, tickformat="%M:%S")
     fig.update_yaxes(tickfont=dict(size=12), title=yaxis_title, showgrid=True, type="log")
     fig.update_layout(title=chart_title, title_font=dict(size=12))
-    streamlit.plotly_chart(fig, use_container_width=True)
+    return fig
 
-def __plot_scatter(x: str, y: str, 
-                 xaxis_title: str, 
-                 yaxis_title: str, 
-                 chart_title: str, samples: dict):
+def __plot_trend(x: str, y: str, 
+               xaxis_title: str, 
+               yaxis_title: str, 
+               chart_title: str, samples: dict):
+
+    with phase("figure"):
+        fig = trend_figure(x=x, y=y, xaxis_title=xaxis_title, yaxis_title=yaxis_title,
+                           chart_title=chart_title, samples=samples)
+    plotly_chart(fig, use_container_width=True)
+
+def scatter_figure(x: str, y: str, 
+                   xaxis_title: str, 
+                   yaxis_title: str, 
+                   chart_title: str, samples: dict) -> go.Figure:
 
     fig = go.Figure()
 
@@ -244,13 +433,23 @@ def __plot_scatter(x: str, y: str,
     fig.update_xaxes(tickfont=dict(size=12), title=xaxis_title, showgrid=True, type="log")
     fig.update_yaxes(tickfont=dict(size=12), title=yaxis_title, showgrid=True)
     fig.update_layout(title=chart_title, title_font=dict(size=12))
-    streamlit.plotly_chart(fig, use_container_width=True)
+    return fig
+
+def __plot_scatter(x: str, y: str, 
+                 xaxis_title: str, 
+                 yaxis_title: str, 
+                 chart_title: str, samples: dict):
+
+    with phase("figure"):
+        fig = scatter_figure(x=x, y=y, xaxis_title=xaxis_title, yaxis_title=yaxis_title,
+                             chart_title=chart_title, samples=samples)
+    plotly_chart(fig, use_container_width=True)
 
 
 
 def __extract_streaming_periods(frame: pandas.DataFrame):
 
-    frame = frame[~frame["event"].str.contains("sniffer|browser|origin|net|app", case=False, na=False)]
+    frame = frame[~frame["event"].str.contains(BOT_EVENTS, case=False, na=False)]
     frame = frame.reset_index(drop=True)
 
     return [(frame.loc[i, "rel"], frame.loc[i + 1, "rel"]) for i in range(0, len(frame) - 1, 2)]
\ No newline at end of file
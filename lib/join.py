@@ -0,0 +1,95 @@
+import numpy
+import pandas
+
+# HTTP transaction to flow join
+# The connection field of the HAR logs is the browser's own connection
+# number, which cannot be matched with Tstat ports. A transaction is carried
+# by a flow towards its url host (the cname of the flow) that is alive when
+# the response ends, since name resolution and handshakes make the request
+# start before the flow. Flows are hashed on (group, host) and sorted by start
+# time, so every transaction is looked up with a single sorted search; among
+# parallel flows towards the same host, the most recently opened one is
+# taken. Groups let many experiments be joined in bulk.
+
+# flows checked, from the most recently opened backwards, before giving up
+DEPTH = 16
+
+# flow columns attached to the transactions
+TCP_COLUMNS = ["c_bytes_all", "s_bytes_all", "c_pkts_retx", "s_pkts_retx", "c_rtt_avg", "s_rtt_avg"]
+UDP_COLUMNS = ["c_bytes_all", "s_bytes_all"]
+
+
+def url_hosts(url: pandas.Series) -> pandas.Series:
+    return url.astype(str).str.extract(r"^\w+://([^/:?#]+)", expand=False)
+
+def match(tx_groups: numpy.ndarray, tx_times: numpy.ndarray,
+          fl_groups: numpy.ndarray, fl_starts: numpy.ndarray, fl_ends: numpy.ndarray) -> numpy.ndarray:
+    # position of the flow of the same group alive at each time, -1 if none
+
+    # flows sorted by group and start, on one timeline where group k is shifted by k spans
+    span  = 1 + max(numpy.abs(fl_starts).max(initial=0), numpy.abs(fl_ends).max(initial=0), numpy.abs(tx_times).max(initial=0))
+    order = numpy.lexsort((fl_starts, fl_groups))
+    keys  = fl_groups[order] * (2 * span) + fl_starts[order]
+
+    # the last flow of the group opened before the time, then the previous ones
+    found = numpy.full(len(tx_times), -1)
+    last  = numpy.searchsorted(keys, tx_groups * (2 * span) + tx_times, side="right") - 1
+    for depth in range(DEPTH):
+        index = last - depth
+        valid = (found < 0) & (index >= 0)
+        index = numpy.maximum(index, 0)
+        valid &= fl_groups[order][index] == tx_groups
+        valid &= fl_ends[order][index] >= tx_times
+        found[valid] = order[index[valid]]
+    return found
+
+def link(transactions: pandas.DataFrame, flows: pandas.DataFrame, by: list[str] | None = None) -> numpy.ndarray:
+    # position in flows of the flow carrying each transaction, -1 if none;
+    # transactions need a host column, flows a cname one, both the columns in by
+    by = by or []
+    left  = transactions[by].assign(host=url_hosts(transactions["url"]) if "host" not in transactions else transactions["host"])
+    right = flows[by].assign(host=flows["cname"].astype(str))
+
+    # one code per (group, host) for both sides, unknown hosts have none
+    keys  = by + ["host"]
+    codes = pandas.concat([left[keys], right[keys]], ignore_index=True).groupby(keys, sort=False, dropna=False).ngroup()
+    codes = codes.to_numpy()
+
+    return match(tx_groups=codes[:len(left)], tx_times=transactions["te"].to_numpy(dtype="float64"),
+                 fl_groups=codes[len(left):], fl_starts=flows["ts"].to_numpy(dtype="float64"),
+                 fl_ends=flows["te"].to_numpy(dtype="float64"))
+
+def join_flows(transactions: pandas.DataFrame, tcom: pandas.DataFrame | None, ucom: pandas.DataFrame | None,
+               by: list[str] | None = None) -> pandas.DataFrame:
+    # flow of every transaction, a TCP flow when there is one, otherwise a UDP (QUIC) one
+    joined = pandas.DataFrame(index=transactions.index)
+    joined["transport"] = pandas.Categorical([None] * len(transactions), categories=["tcp", "udp"])
+    joined["flow"] = None
+    for column in TCP_COLUMNS:
+        joined[column] = numpy.nan
+
+    for transport, flows, columns in (("tcp", tcom, TCP_COLUMNS), ("udp", ucom, UDP_COLUMNS)):
+        if flows is None or not len(flows):
+            continue
+        found = link(transactions, flows, by)
+        found[joined["transport"].notna().to_numpy()] = -1
+        rows  = found >= 0
+
+        carried = flows.iloc[found[rows]]
+        joined.loc[rows, "transport"] = transport
+        joined.loc[rows, "flow"] = carried["id"].astype(str).to_numpy()
+        for column in columns:
+            joined.loc[rows, column] = carried[column].to_numpy(dtype="float64")
+    return joined
+
+def flow_bins(periodic: pandas.DataFrame | None) -> dict[str, numpy.ndarray]:
+    # positions of the periodic bins of every flow
+    if periodic is None:
+        return {}
+    return {str(flow): index for flow, index in periodic.groupby("id", observed=True, sort=False).indices.items()}
+
+def transaction_bins(periodic: pandas.DataFrame, bins: dict[str, numpy.ndarray],
+                     flow: str, ts: float, te: float) -> pandas.DataFrame:
+    # periodic bins of a flow overlapping a transaction
+    data = periodic.iloc[bins.get(flow, [])]
+    return data[(data["te"] >= ts) & (data["ts"] <= te)]
@@ -0,0 +1,163 @@
+import os
+import sys
+import threading
+import contextlib
+import contextvars
+import dataclasses
+import collections
+import numpy
+import pandas
+
+from typing import Any
+from typing import Callable
+
+from lib.profiler import count
+
+# Shared memory cache
+# One cache per process for the loaded experiments and the frames derived
+# from them, shared by every session (and by the scripts running outside of
+# Streamlit). Every entry is accounted by its size in memory, the deep size
+# of the frames it holds, and once the total exceeds the budget the least
+# recently used entries are evicted. Entries are handed out as they are
+# stored, without copies: callers never write into a shared frame, they
+# filter it first. A value is loaded once even when several sessions ask for
+# it at the same time, the others wait for it. Hits, misses and evictions
+# are counted per kind of entry. Values loaded ahead of time (prefetching)
+# are not uses: they are counted apart, along with how many of them were
+# used afterwards.
+
+# memory budget of the cache (MiB), TSTAT_CACHE_MB overrides it
+BUDGET = int(os.environ.get("TSTAT_CACHE_MB", 2048))
+
+# whether the values fetched in this thread are loaded ahead of time
+PREFETCHING = contextvars.ContextVar("prefetching", default=False)
+
+# counters of every kind of entry
+COUNTERS = ["hits", "misses", "evictions", "prefetched", "prefetch hits"]
+
+
+def footprint(value: Any) -> int:
+    # bytes held by a value, frames and arrays are measured deeply
+    if value is None:
+        return 0
+    if isinstance(value, pandas.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pandas.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(footprint(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(footprint(item) for item in value)
+    if dataclasses.is_dataclass(value):
+        return sum(footprint(getattr(value, field.name)) for field in dataclasses.fields(value))
+    return sys.getsizeof(value)
+
+
+class Cache:
+
+    def __init__(self, budget: int):
+        # budget in bytes
+        self.budget   = budget
+        self.size     = 0
+        self.lock     = threading.Lock()
+        self.entries  = collections.OrderedDict()
+        self.loading  = {}
+        # entries loaded ahead of time and not used yet, with their size
+        self.prefetched = {}
+        self.counters = collections.defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    def __lookup(self, kind: str, key: tuple, prefetching: bool) -> tuple[bool, Any]:
+        # under the lock, a use moves the entry to the most recently used end
+        entry = self.entries.get((kind, key))
+        if entry is None:
+            return False, None
+        if not prefetching:
+            self.entries.move_to_end((kind, key))
+            self.counters[kind]["hits"] += 1
+            if self.prefetched.pop((kind, key), None) is not None:
+                self.counters[kind]["prefetch hits"] += 1
+        return True, entry[0]
+
+    def __store(self, kind: str, key: tuple, value: Any, size: int, prefetching: bool):
+        # under the lock; a value larger than the whole budget is not kept
+        self.counters[kind]["prefetched" if prefetching else "misses"] += 1
+        if size > self.budget:
+            return
+        self.entries[(kind, key)] = (value, size)
+        self.size += size
+        if prefetching:
+            self.prefetched[(kind, key)] = size
+        while self.size > self.budget:
+            (evicted, stale), (_, freed) = self.entries.popitem(last=False)
+            self.size -= freed
+            self.prefetched.pop((evicted, stale), None)
+            self.counters[evicted]["evictions"] += 1
+
+    def fetch(self, kind: str, key: tuple, load: Callable[[], Any]) -> Any:
+        prefetching = PREFETCHING.get()
+        with self.lock:
+            found, value = self.__lookup(kind, key, prefetching)
+            if found:
+                count(kind)
+                return value
+            pending = self.loading.setdefault((kind, key), threading.Lock())
+
+        # one session loads the value, the others wait for it
+        with pending:
+            with self.lock:
+                found, value = self.__lookup(kind, key, prefetching)
+            if found:
+                count(kind)
+                return value
+            try:
+                value = load()
+                size  = footprint(value)
+                with self.lock:
+                    self.__store(kind, key, value, size, prefetching)
+            finally:
+                with self.lock:
+                    self.loading.pop((kind, key), None)
+        count(kind, misses=1)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.prefetched.clear()
+            self.size = 0
+
+    def pending(self) -> int:
+        # bytes of the entries loaded ahead of time and not used yet
+        with self.lock:
+            return sum(self.prefetched.values())
+
+    def stats(self) -> pandas.DataFrame:
+        with self.lock:
+            sizes = collections.Counter()
+            items = collections.Counter()
+            for (kind, _), (_, size) in self.entries.items():
+                sizes[kind] += size
+                items[kind] += 1
+            rows = [(kind, items[kind], sizes[kind] / 2 ** 20, *(counters[name] for name in COUNTERS))
+                    for kind, counters in self.counters.items()]
+        return pandas.DataFrame(rows, columns=["cache", "entries", "size [MiB]", *COUNTERS])
+
+
+# shared by every session of the process
+SHARED = Cache(BUDGET << 20)
+
+
+def fetch(kind: str, key: tuple, load: Callable[[], Any]) -> Any:
+    # value of the key, loaded and accounted the first time it is asked for
+    return SHARED.fetch(kind, key, load)
+
+@contextlib.contextmanager
+def prefetching():
+    # the values fetched within are loaded ahead of time, not used
+    token = PREFETCHING.set(True)
+    try:
+        yield
+    finally:
+        PREFETCHING.reset(token)
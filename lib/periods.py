@@ -0,0 +1,65 @@
+import numpy
+import pandas
+
+from lib.classify import KINDS
+
+# Streaming period bucketing
+# Assigns HTTP transactions to the streaming periods of their experiment with
+# a single sorted search, and counts them per period and media kind. The
+# periods of all the experiments are laid on one timeline, experiment k being
+# shifted by k times the longest experiment, so that any number of
+# experiments is bucketed in one pass.
+
+# media kinds counted per period
+CLASSES = list(KINDS.groupindex)
+
+
+def bucket(times: numpy.ndarray, starts: numpy.ndarray, ends: numpy.ndarray) -> numpy.ndarray:
+    # index of the period holding each time, -1 if none; periods are
+    # sorted, disjoint and include both bounds
+    if not len(starts):
+        return numpy.full(len(times), -1)
+    index  = numpy.searchsorted(starts, times, side="right") - 1
+    inside = (index >= 0) & (times <= ends[numpy.maximum(index, 0)])
+    return numpy.where(inside, index, -1)
+
+def period_counts(transactions: dict[str, pandas.DataFrame | None],
+                  periods: dict[str, list[tuple[float, float]]]) -> pandas.DataFrame:
+    # number of transactions of each media kind, and per second, for every
+    # streaming period of every experiment
+    experiments = list(periods)
+
+    bounds = [numpy.asarray(periods[key], dtype="float64").reshape(-1, 2) for key in experiments]
+    times  = [transactions[key]["ts"].to_numpy(dtype="float64")
+              if transactions.get(key) is not None else numpy.empty(0) for key in experiments]
+    offset = 1 + max([0.0] + [array.max() for array in bounds + times if array.size])
+
+    # one timeline for all the experiments; transactions out of it belong to no period
+    starts = numpy.concatenate([array[:, 0] + k * offset for k, array in enumerate(bounds)])
+    ends   = numpy.concatenate([array[:, 1] + k * offset for k, array in enumerate(bounds)])
+    shift  = numpy.concatenate([numpy.where((array >= 0) & (array < offset), array + k * offset, numpy.nan)
+                                for k, array in enumerate(times)])
+    index  = bucket(shift, starts, ends)
+
+    kinds = numpy.concatenate([transactions[key]["kind"].cat.codes.to_numpy(dtype="int64")
+                               if transactions.get(key) is not None else numpy.empty(0, dtype="int64")
+                               for key in experiments])
+
+    # one counter per period and kind, transactions without a kind are left out
+    inside = (index >= 0) & (kinds >= 0)
+    counts = numpy.bincount(index[inside] * len(CLASSES) + kinds[inside], minlength=len(starts) * len(CLASSES))
+    counts = dict(zip(CLASSES, counts.reshape(-1, len(CLASSES)).T))
+
+    data = pandas.DataFrame({
+        "experiment": numpy.repeat(experiments, [len(array) for array in bounds]),
+        "period":     numpy.concatenate([numpy.arange(len(array)) for array in bounds]),
+        "ts":         numpy.concatenate([array[:, 0] for array in bounds]),
+        "te":         numpy.concatenate([array[:, 1] for array in bounds]),
+        **counts,
+    })
+
+    # rates are computed over whole seconds, periods shorter than one have none
+    data["span"] = ((data["te"] - data["ts"]) / 1000).astype("int64")
+    for name in CLASSES:
+        data[f"{name}_rate"] = (data[name] / data["span"]).where(data["span"] > 0, 0)
+    return data
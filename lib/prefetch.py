@@ -0,0 +1,85 @@
+import os
+import threading
+import concurrent.futures
+import streamlit
+
+from lib.catalog import Catalog
+
+from lib.experiment import DOCUMENTS
+from lib.experiment import open_experiment
+
+from lib.memory import SHARED
+from lib.memory import prefetching
+
+# Prefetching of neighbouring experiments
+# While an experiment is shown, the ones an analyst is likely to open next
+# (the next and previous test of the same rate, then the same test at the
+# adjacent rates) are loaded and formatted in the background, into the
+# shared memory cache. Every session has its own warm-up, cancelled as soon
+# as it selects another experiment: queued experiments are dropped and a
+# running one stops before its next log. Prefetching pauses while the logs
+# loaded ahead of time and not used yet exceed their own budget, so that it
+# never pushes out much of what the sessions are using. How many prefetched
+# logs are used afterwards is reported with the cache counters (lib.memory).
+
+# threads loading experiments ahead of time
+WORKERS = 2
+
+# memory budget (MiB) of the logs loaded ahead of time and not used yet,
+# TSTAT_PREFETCH_MB overrides it
+BUDGET = int(os.environ.get("TSTAT_PREFETCH_MB", 256))
+
+# shared by every session
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="prefetch")
+
+
+class Prefetch:
+
+    def __init__(self, target: tuple):
+        # the experiment whose neighbours are warmed up
+        self.target    = target
+        self.cancelled = threading.Event()
+        self.futures   = []
+
+    def cancel(self):
+        self.cancelled.set()
+        for future in self.futures:
+            future.cancel()
+
+
+def neighbours(catalog: Catalog, rate: str, test: str, tests: list[str]) -> list[tuple[str, str, tuple]]:
+    # experiments likely to be opened after this one, the most likely first, with their stamps
+    near = []
+    if test in tests:
+        index = tests.index(test)
+        near += [(rate, tests[i]) for i in (index + 1, index - 1) if 0 <= i < len(tests)]
+
+    rates = catalog.rates()
+    if rate in rates:
+        index = rates.index(rate)
+        near += [(rates[i], test) for i in (index + 1, index - 1)
+                 if 0 <= i < len(rates) and test in catalog.tests(rates[i])]
+    return [(rate, test, catalog.stamp(rate=rate, test=test)) for rate, test in near]
+
+def warm(server: str, rate: str, test: str, stamp: tuple, cancelled: threading.Event):
+    with prefetching():
+        experiment = open_experiment(server, rate, test, stamp)
+        for document in DOCUMENTS:
+            if cancelled.is_set() or SHARED.pending() > BUDGET << 20:
+                return
+            experiment.frame(document)
+
+def prefetch(server: str, catalog: Catalog, rate: str, test: str, tests: list[str]):
+    # warm up the neighbours of the experiment shown in this session,
+    # once per selection, cancelling the warm-up of the previous one
+    target  = (server, rate, test)
+    current = streamlit.session_state.get("prefetch")
+    if current is not None and current.target == target:
+        return
+    if current is not None:
+        current.cancel()
+
+    task = Prefetch(target)
+    for rate, test, stamp in neighbours(catalog, rate, test, tests):
+        task.futures.append(executor.submit(warm, server, rate, test, stamp, task.cancelled))
+    streamlit.session_state["prefetch"] = task
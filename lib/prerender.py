@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import argparse
+import collections
+import concurrent.futures
+import streamlit.config
+import streamlit.logger
+
+from lib.generic import Protocol
+from lib.generic import Document
+from lib.generic import LIMIT
+from lib.generic import timeline_figure
+
+from lib.experiment import open_experiment
+
+from lib.catalog import load_catalog
+
+from lib.figures import STORE
+from lib.figures import has_figure
+from lib.figures import figure_path
+from lib.figures import store_figure
+from lib.figures import stored_keys
+
+from lib.dazn.__fst_section import SERVER
+from lib.dazn.__fst_section import LAYER4
+from lib.dazn.__fst_section import layer4_key
+from lib.dazn.__fst_section import layer7_key
+from lib.dazn.__fst_section import layer4_frame
+from lib.dazn.__fst_section import layer4_titles
+from lib.dazn.__fst_section import layer7_figure
+from lib.dazn.__fst_section import capture_span
+
+from lib.dazn.__trd_section import OPTIONS
+from lib.dazn.__trd_section import chart_keys
+from lib.dazn.__trd_section import chart_figure
+from lib.dazn.__trd_section import load_samples
+
+# Offline figure renderer
+# Renders the figures the dashboard can serve from the store (lib.figures):
+# for every experiment shown in Ricostruzione Flussi, the timelines of every
+# TCP and UDP CNAME over the whole capture and the timeline of the HTTP
+# transactions, and the charts of Misurazioni at every step. Work is spread
+# over a pool of processes, an experiment per task, and only the figures
+# missing from the store are rendered: a run after a test campaign renders
+# the new and changed experiments, and the charts of the rates they belong
+# to. Stored figures no longer reachable can be removed (--prune).
+#
+#   python -m lib.prerender [RATE ...] [--workers N] [--prune]
+
+
+def experiment_keys(rate: str, test: str, stamp: tuple) -> list[str]:
+    root = os.path.join(SERVER, rate, test)
+    keys = [layer4_key(root=root, stamp=stamp, protocol=protocol, document=document)
+            for protocol, documents in LAYER4.items() for document in documents]
+    return keys + [layer7_key(root=root, stamp=stamp)]
+
+def render_experiment(rate: str, test: str, stamp: tuple) -> int:
+    # figures of an experiment missing from the store, as the sections build them
+    experiment = open_experiment(SERVER, rate, test, stamp)
+    meta = experiment.meta
+
+    rendered = 0
+    for protocol, (complete, periodic) in LAYER4.items():
+        com = experiment.frame(complete)
+        for document in (complete, periodic):
+            key = layer4_key(root=experiment.root, stamp=stamp, protocol=protocol, document=document)
+            if has_figure(key):
+                continue
+            fig = None
+            if com is not None:
+                window = (0, capture_span(meta=meta, data=com) * 1000)
+                data = layer4_frame(data=experiment.frame(document), protocol=protocol, document=document,
+                                    cnames=list(set(com["cname"])), window=window)
+                if data is not None:
+                    fig = timeline_figure(data=data, meta=meta, xs="datetime_ts", xe="datetime_te", y="id",
+                                          color="cname", **layer4_titles(protocol=protocol, document=document),
+                                          hover=(protocol, document), window=window)
+            store_figure(key, fig)
+            rendered += 1
+
+    key = layer7_key(root=experiment.root, stamp=stamp)
+    if not has_figure(key):
+        hcom = experiment.frame(Document.LOG_HAR_COMPLETE)
+        store_figure(key, layer7_figure(hcom=hcom, meta=meta) if hcom is not None else None)
+        rendered += 1
+    return rendered
+
+def render_samples(steps: list[str], protocols: list[Protocol]) -> int:
+    # charts of Misurazioni missing from the store; the samples are loaded only if some is
+    rendered = 0
+    for step in steps:
+        for protocol in protocols:
+            missing = {chart: key for chart, key in chart_keys(step, protocol).items() if not has_figure(key)}
+            if not missing:
+                continue
+            samples = load_samples(step=step, protocol=protocol)
+            for chart, key in missing.items():
+                store_figure(key, chart_figure(chart, samples))
+            rendered += len(missing)
+    return rendered
+
+def quiet():
+    # shared resources work without a script run context, quietly
+    streamlit.config.set_option("logger.level", "error")
+    streamlit.logger.set_log_level("error")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Render the figures of the dashboard into the figure store")
+    parser.add_argument("rates", nargs="*", help="rates whose experiments are rendered, all of them by default")
+    parser.add_argument("--workers", default=None, type=int, help="number of processes")
+    parser.add_argument("--prune", action="store_true", help="remove the stored figures no longer in use")
+    args = parser.parse_args()
+
+    quiet()
+    start   = time.perf_counter()
+    catalog = load_catalog(SERVER)
+    rates   = args.rates or catalog.rates()
+
+    # keys of every figure, to tell the missing ones and the unused ones apart
+    experiments = {(rate, test): catalog.stamp(rate=rate, test=test)
+                   for rate in catalog.rates() for test in catalog.tests(rate)[:LIMIT]}
+    keys = {experiment: experiment_keys(*experiment, stamp) for experiment, stamp in experiments.items()}
+    charts = {step: [key for protocol in [Protocol.TCP, Protocol.UDP] for key in chart_keys(step, protocol).values()]
+              for step in OPTIONS}
+
+    # a task per protocol, over every step of the slider
+    samples = [(OPTIONS, [protocol]) for protocol in [Protocol.TCP, Protocol.UDP]]
+
+    done = collections.Counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=quiet) as executor:
+        futures = {}
+        for (rate, test), stamp in experiments.items():
+            if rate in rates and not all(has_figure(key) for key in keys[(rate, test)]):
+                futures[executor.submit(render_experiment, rate, test, stamp)] = rate
+        for steps, protocols in samples:
+            if not all(has_figure(key) for step in steps for key in charts[step]):
+                futures[executor.submit(render_samples, steps, protocols)] = "media"
+
+        for future in concurrent.futures.as_completed(futures):
+            done[futures[future]] += future.result()
+
+    for name, rendered in done.items():
+        print(f"{name}: {rendered} figures rendered")
+    print(f"{sum(done.values())} figures rendered in {time.perf_counter() - start:.2f} s, "
+          f"the others are up to date in {STORE}")
+
+    if args.prune:
+        used   = {key for values in [*keys.values(), *charts.values()] for key in values}
+        unused = stored_keys() - used
+        for key in unused:
+            os.remove(figure_path(key))
+        print(f"{len(unused)} unused figures removed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import datetime
+import contextlib
+import contextvars
+import streamlit
+
+# Rerun profiler
+# Opt-in instrumentation of a rerun: sections and phases (parsing, cache
+# reads, formatting, filtering, figure building, chart rendering) are timed
+# with their self time, excluding nested phases, so that the breakdown adds
+# up to the rerun. Caches count their calls and misses, and every chart
+# records the size of its serialized payload. The profile of the last rerun
+# is shown in the sidebar and can be appended to a JSONL file. A fragment
+# rerunning alone (a section of Ricostruzione Flussi) is profiled on its own
+# and shows its profile in its own body, as the sidebar is out of its reach.
+# Nothing is recorded, and almost nothing is spent, while profiling is off.
+# pandas is imported only to show a profile, pages without frames do not
+# need it.
+
+# file collecting the profiles of the reruns
+PROFILE = os.path.join(".cache", "profile.jsonl")
+
+# profile of the rerun running in this thread, None when profiling is off
+CURRENT = contextvars.ContextVar("profile", default=None)
+
+# session state of the sidebar controls, read by the fragments rerunning alone
+ENABLED = "profiling"
+SAVE    = "profiling_save"
+
+
+class Profile:
+
+    def __init__(self, page: str):
+        self.page    = page
+        self.start   = time.perf_counter()
+        self.section = page
+        self.stack   = []
+        self.phases  = {}
+        self.caches  = {}
+        self.charts  = []
+
+    def enter(self):
+        self.stack.append([time.perf_counter(), 0.0])
+
+    def leave(self, name: str):
+        start, nested = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        if self.stack:
+            self.stack[-1][1] += elapsed
+
+        # self time, the nested phases are accounted on their own
+        entry = self.phases.setdefault((self.section, name), [0.0, 0])
+        entry[0] += elapsed - nested
+        entry[1] += 1
+
+    def frames(self) -> tuple["pandas.DataFrame", "pandas.DataFrame", "pandas.DataFrame"]:
+        import pandas
+        phases = pandas.DataFrame([(section, name, seconds * 1000, calls)
+                                   for (section, name), (seconds, calls) in self.phases.items()],
+                                  columns=["section", "phase", "time [ms]", "calls"])
+        caches = pandas.DataFrame([(name, calls - misses, misses)
+                                   for name, (calls, misses) in self.caches.items()],
+                                  columns=["cache", "hits", "misses"])
+        charts = pandas.DataFrame([(section, chart, size / 1024) for section, chart, size in self.charts],
+                                  columns=["section", "chart", "payload [KiB]"])
+        return phases, caches, charts
+
+    def record(self) -> dict:
+        return {"time":    datetime.datetime.now().isoformat(timespec="seconds"),
+                "page":    self.page,
+                "total":   time.perf_counter() - self.start,
+                "phases":  [{"section": section, "phase": name, "seconds": seconds, "calls": calls}
+                            for (section, name), (seconds, calls) in self.phases.items()],
+                "caches":  {name: {"calls": calls, "misses": misses} for name, (calls, misses) in self.caches.items()},
+                "charts":  [{"section": section, "chart": chart, "bytes": size}
+                            for section, chart, size in self.charts]}
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    profile = CURRENT.get()
+    if profile is None:
+        yield
+        return
+    profile.enter()
+    try:
+        yield
+    finally:
+        profile.leave(name)
+
+@contextlib.contextmanager
+def section(name: str):
+    profile = CURRENT.get()
+    if profile is None:
+        yield
+        return
+    outer, profile.section = profile.section, name
+    try:
+        with phase("other"):
+            yield
+    finally:
+        profile.section = outer
+
+def count(cache: str, calls: int = 1, misses: int = 0):
+    profile = CURRENT.get()
+    if profile is None:
+        return
+    entry = profile.caches.setdefault(cache, [0, 0])
+    entry[0] += calls
+    entry[1] += misses
+
+def plotly_chart(fig, **kwargs):
+    profile = CURRENT.get()
+    if profile is not None:
+        # serialized once more, only while profiling
+        profile.charts.append((profile.section, fig.layout.title.text or "", len(fig.to_json())))
+    with phase("render"):
+        streamlit.plotly_chart(fig, **kwargs)
+
+@contextlib.contextmanager
+def fragment(name: str):
+    # a section of the page: part of the profile of the page while the page
+    # reruns, profiled on its own when the fragment reruns alone
+    if CURRENT.get() is not None or not streamlit.session_state.get(ENABLED, False):
+        with section(name):
+            yield
+        return
+    start(page=name, enabled=True)
+    try:
+        with section(name):
+            yield
+    finally:
+        finish(path=PROFILE if streamlit.session_state.get(SAVE, False) else None, inline=True)
+
+def start(page: str, enabled: bool):
+    CURRENT.set(Profile(page) if enabled else None)
+
+def finish(path: str | None = None, inline: bool = False):
+    profile = CURRENT.get()
+    if profile is None:
+        return
+    CURRENT.set(None)
+
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as file:
+            file.write(json.dumps(profile.record()) + "\n")
+
+    phases, caches, charts = profile.frames()
+    title = f"Profilo ({(time.perf_counter() - profile.start) * 1000:.0f} ms)"
+    with streamlit.expander(title) if inline else streamlit.sidebar:
+        if not inline:
+            streamlit.caption(f"#### {title}")
+        streamlit.dataframe(phases.sort_values("time [ms]", ascending=False),
+                            use_container_width=True, hide_index=True)
+        if not caches.empty:
+            streamlit.dataframe(caches, use_container_width=True, hide_index=True)
+        if not charts.empty:
+            streamlit.dataframe(charts, use_container_width=True, hide_index=True)
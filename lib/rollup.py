@@ -0,0 +1,41 @@
+import numpy
+import pandas
+
+# Multi-resolution rollups of binned media logs
+# Every dazn/<rate>/media/<protocol>/<step> tree holds the same experiments
+# binned at a different step. Steps without a tree are derived from the
+# finest one by merging runs of consecutive bins. Only the traffic counters
+# are rolled up, as their sums are exactly the ones Tstat computes at the
+# coarser step. Request counts, connections, rates and bin durations depend
+# on how Tstat cuts the requests and periodic bins straddling the border of
+# two bins, and cannot be derived from the finer bins.
+
+# steps of the media trees, the first one is the finest
+STEPS = ["1000", "2000", "5000", "10000"]
+
+# counters holding the amount of traffic of a bin, the ones rolled up
+COUNTERS = [
+    "c_pkts_all", "c_ack_cnt", "c_ack_cnt_p", "c_bytes_all", "c_bytes_uniq",
+    "s_pkts_all", "s_ack_cnt", "s_ack_cnt_p", "s_bytes_all", "s_bytes_uniq",
+    "c_pkts_retx", "s_pkts_retx", "c_pkts_data", "s_pkts_data"]
+
+
+def rollup(data: pandas.DataFrame, steps: list[int]) -> dict[int, pandas.DataFrame]:
+    # sum the traffic counters of a media log into bins of each of the given
+    # steps (ms), which must be multiples of the step of the log
+    data = data.sort_values("ts")
+
+    # the log is turned into arrays once, empty fields mean nothing was observed
+    counters = [column for column in COUNTERS if column in data.columns]
+    matrix   = numpy.nan_to_num(data[counters].to_numpy(dtype="float64"))
+
+    rollups = {}
+    for step in steps:
+        bins   = (data["ts"].to_numpy(dtype="float64") // step).astype("int64")
+        starts = numpy.flatnonzero(numpy.r_[True, bins[1:] != bins[:-1]])
+
+        merged = {"ts": bins[starts] * float(step)}
+        merged["te"] = merged["ts"] + step
+        merged.update(zip(counters, numpy.add.reduceat(matrix, starts).T))
+        rollups[step] = pandas.DataFrame(merged)
+    return rollups
@@ -0,0 +1,133 @@
+import hashlib
+import pandas
+
+from lib.generic import Document
+
+# Schema registry for Tstat logs
+# Every log is loaded with explicit, compact dtypes instead of pandas'
+# default inference. Low cardinality strings (addresses, cnames, mime types,
+# methods, events) become categoricals, free text becomes arrow backed
+# strings and measurements that are never shown verbatim become float32.
+# Integer counters not listed here are downcast to the smallest integer type
+# holding their values, while timestamps and any other float keep float64.
+
+CATEGORY = "category"
+STRING   = "string[pyarrow]"
+FLOAT    = "float32"
+
+# layer 4 flow identifiers
+FLOW = {
+    "c_ip":  CATEGORY,
+    "s_ip":  CATEGORY,
+    "id":    CATEGORY,
+    "cname": CATEGORY,
+}
+
+# layer 7 transactions
+HTTP = {
+    "method": CATEGORY,
+    "url":    STRING,
+    "mime":   CATEGORY,
+}
+
+# binned media logs, every measurement is averaged before being shown
+MEDIA = {column: FLOAT for column in [
+    "c_pkts_all", "c_ack_cnt", "c_ack_cnt_p", "c_bytes_all", "c_bytes_uniq",
+    "s_pkts_all", "s_ack_cnt", "s_ack_cnt_p", "s_bytes_all", "s_bytes_uniq",
+    "c_pkts_retx", "s_pkts_retx", "c_pkts_data", "s_pkts_data",
+    "max_bin_duration", "min_bin_duration", "avg_bin_duration", "std_bin_duration",
+    "max_video_rate", "min_video_rate", "avg_video_rate", "std_video_rate",
+    "max_audio_rate", "min_audio_rate", "avg_audio_rate", "std_audio_rate",
+    "video_reqs", "audio_reqs", "media_reqs"]}
+
+SCHEMAS = {
+    Document.LOG_TCP_COMPLETE: {
+        **FLOW,
+        "durat":             FLOAT,
+        "c_rtt_avg":         FLOAT,
+        "c_rtt_min":         FLOAT,
+        "c_rtt_max":         FLOAT,
+        "c_rtt_std":         FLOAT,
+        "s_rtt_avg":         FLOAT,
+        "s_rtt_min":         FLOAT,
+        "s_rtt_max":         FLOAT,
+        "s_rtt_std":         FLOAT,
+        "c_last_handshakeT": FLOAT,
+        "s_last_handshakeT": FLOAT,
+        "c_appdataT":        FLOAT,
+        "s_appdataT":        FLOAT,
+        "req_tm":            FLOAT,
+        "res_tm":            FLOAT,
+        "http_res":          CATEGORY,
+        "c_tls_SNI":         CATEGORY,
+        "s_tls_SCN":         CATEGORY,
+        "fqdn":              CATEGORY,
+        "dns_rslv":          CATEGORY,
+        "http_hostname":     CATEGORY,
+        "c_TLSvers":         CATEGORY,
+        "s_TLSvers":         CATEGORY,
+    },
+    Document.LOG_TCP_PERIODIC: {
+        **FLOW,
+        "time_rel_start": FLOAT,
+        "time_rel_end":   FLOAT,
+        "bin_duration":   FLOAT,
+        "c_rtt_avg":      FLOAT,
+        "s_rtt_avg":      FLOAT,
+    },
+    Document.LOG_UDP_COMPLETE: {
+        **FLOW,
+        "c_durat":     FLOAT,
+        "s_durat":     FLOAT,
+        "fqdn":        CATEGORY,
+        "quic_SNI":    CATEGORY,
+        "quic_UA":     CATEGORY,
+        "quic_c_vers": CATEGORY,
+        "quic_s_vers": CATEGORY,
+    },
+    Document.LOG_UDP_PERIODIC: {
+        **FLOW,
+        "time_rel_start": FLOAT,
+        "time_rel_end":   FLOAT,
+        "bin_duration":   FLOAT,
+    },
+    Document.LOG_HAR_COMPLETE: {
+        **HTTP,
+        "video_rate": CATEGORY,
+        "audio_rate": CATEGORY,
+    },
+    Document.LOG_VIDEO_COMPLETE: HTTP,
+    Document.LOG_AUDIO_COMPLETE: HTTP,
+    Document.LOG_BOT_COMPLETE: {
+        "event": CATEGORY,
+    },
+    Document.LOG_TCP_MEDIA: MEDIA,
+    Document.LOG_UDP_MEDIA: MEDIA,
+}
+
+# bump whenever parsing, apply_schema or lib.classify change the way logs are converted
+VERSION = 4
+
+
+def schema_tag(document: Document | None) -> str:
+    # short digest of a schema, cached copies built with another one are stale
+    schema = sorted(SCHEMAS.get(document, {}).items())
+    return hashlib.sha1(repr((VERSION, schema)).encode()).hexdigest()[:8]
+
+def text_columns(document: Document | None) -> list[str]:
+    # columns registered as text, whatever their values look like (0x1 is not a number)
+    return [column for column, dtype in SCHEMAS.get(document, {}).items() if dtype in (CATEGORY, STRING)]
+
+def apply_schema(data: pandas.DataFrame, document: Document | None) -> pandas.DataFrame:
+    schema = SCHEMAS.get(document, {})
+
+    dtypes = {}
+    for column in data.columns:
+        dtype = schema.get(column)
+        if dtype is None and pandas.api.types.is_integer_dtype(data[column]):
+            dtype = pandas.to_numeric(data[column], downcast="integer").dtype
+        if dtype is not None:
+            dtypes[column] = dtype
+
+    # astype leaves one block per converted column, copy consolidates them
+    return data.astype(dtypes).copy()
@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+# Startup report
+# Measures what the first visitor after a restart of the server waits for.
+# Every measure runs in a fresh interpreter through Streamlit's AppTest: the
+# boot is the time from the start of the interpreter to the end of the first
+# run of the app (Introduzione), then a page is chosen and the time to its
+# first chart and to the end of its run are taken. Every page is measured
+# cold and after the warm-up (lib.warmup), which is waited for before the
+# page is chosen. The disk caches (arrow copies, catalog, figure store) are
+# left as they are: run the report twice to leave their first build out.
+#
+#   python -m lib.startup [--repeat N] [--page PAGE]
+
+# script of the app, as run by the server
+SCRIPT = os.path.join("pages", "1_dazn.py")
+
+# pages measured, with the toggles to switch on to see a chart
+PAGES = {
+    "Ricostruzione Flussi": [2],
+    "Profilazione CNAMEs":  [],
+    "Misurazioni":          [],
+}
+
+# libraries the lazy imports keep out of the boot
+HEAVY = ["pandas", "numpy", "pyarrow", "plotly.express"]
+
+
+def measure(page: str, spawned: float) -> dict:
+    # in the fresh interpreter; every chart goes through streamlit.plotly_chart
+    import streamlit
+    import streamlit.logger
+    from streamlit.testing.v1 import AppTest
+
+    streamlit.logger.set_log_level("error")
+
+    charts = []
+    plotly_chart = streamlit.plotly_chart
+    def record(*args, **kwargs):
+        charts.append(time.time())
+        return plotly_chart(*args, **kwargs)
+    streamlit.plotly_chart = record
+
+    app = AppTest.from_file(SCRIPT, default_timeout=3600)
+    app.run()
+    result = {"boot": time.time() - spawned, "heavy": [name for name in HEAVY if name in sys.modules]}
+
+    from lib import warmup
+    thread = warmup.start()
+    if thread is not None:
+        start = time.time()
+        thread.join()
+        result["warm-up"] = time.time() - start
+
+    chosen = time.time()
+    app.radio[0].set_value(page)
+    app.run()
+    for index in PAGES[page]:
+        app.main.toggle[index].set_value(True)
+        app.run()
+    result["first chart"] = charts[0] - chosen if charts else None
+    result["page"] = time.time() - chosen
+    result["errors"] = len(app.exception)
+    return result
+
+def spawn(page: str, warm: bool) -> dict:
+    env = dict(os.environ, TSTAT_WARMUP="1" if warm else "0")
+    spawned = time.time()
+    output  = subprocess.run([sys.executable, "-m", "lib.startup", "--child", page, "--spawned", str(spawned)],
+                             env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def seconds(values: list[float | None]) -> str:
+    values = [value for value in values if value is not None]
+    return f"{statistics.median(values):.2f}" if values else "-"
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure startup time and time to first chart")
+    parser.add_argument("--repeat",  default=1, type=int, help="runs of every measure, the median is reported")
+    parser.add_argument("--page",    default=None, choices=list(PAGES), help="measure this page only")
+    parser.add_argument("--child",   default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--spawned", default=None, type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure(args.child, args.spawned)))
+        return 0
+
+    print(f"{'page':<22} {'warm-up':<8} {'boot [s]':>9} {'warm-up [s]':>12} {'first chart [s]':>16} "
+          f"{'page [s]':>9}  heavy modules at boot")
+    for page in [args.page] if args.page else PAGES:
+        for warm in (False, True):
+            runs = [spawn(page, warm) for _ in range(args.repeat)]
+            # the warm-up imports them on purpose
+            heavy = (", ".join(runs[-1]["heavy"]) or "none") if not warm else "-"
+            errors = sum(run["errors"] for run in runs)
+            print(f"{page:<22} {'yes' if warm else 'no':<8} {seconds([run['boot'] for run in runs]):>9} "
+                  f"{seconds([run.get('warm-up') for run in runs]):>12} "
+                  f"{seconds([run['first chart'] for run in runs]):>16} {seconds([run['page'] for run in runs]):>9}  "
+                  f"{heavy}" + (f" ({errors} errors)" if errors else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import os
+import json
+import tempfile
+import numpy
+import pandas
+import pyarrow
+import pyarrow.csv
+import pyarrow.ipc
+import pyarrow.compute
+
+from lib.generic import Document
+
+from lib.schema import schema_tag
+from lib.schema import apply_schema
+from lib.schema import text_columns
+
+from lib.classify import classify
+
+from lib.profiler import phase
+from lib.profiler import count
+
+# Columnar cache for Tstat logs
+# Each space-separated log (dazn/<rate>/test-N/log_*, dazn/<rate>/media/...)
+# is parsed by Arrow's multithreaded CSV reader and converted into a typed
+# Arrow IPC file the first time it is read, using the dtypes registered for
+# its document in lib.schema and with the labels added by lib.classify.
+# Following reads memory-map the Arrow copy instead of parsing text, and the
+# copy is rebuilt whenever the size or the modification time of the source,
+# or the schema, changes. Readers ask for the columns they use, the others
+# are never converted to pandas. Logs of flows and transactions are stored
+# sorted by start time, in record batches with a sparse time index (first
+# start, last end and first row of every batch): a reader asking for a time
+# window maps only the batches overlapping it, and gets its rows with their
+# positions in the whole log as index.
+
+CACHE = ".cache"
+
+# key of the arrow metadata entry storing the source signature
+SOURCE_KEY = b"tstat.source"
+
+# key of the arrow metadata entry storing the time index
+INDEX_KEY = b"tstat.index"
+
+# rows of a record batch, the granularity of the time index
+BATCH = 1024
+
+# logs stored sorted by start time, with a time index
+SORTED = {
+    Document.LOG_TCP_COMPLETE,
+    Document.LOG_TCP_PERIODIC,
+    Document.LOG_UDP_COMPLETE,
+    Document.LOG_UDP_PERIODIC,
+    Document.LOG_HAR_COMPLETE,
+    Document.LOG_VIDEO_COMPLETE,
+    Document.LOG_AUDIO_COMPLETE,
+}
+
+# arrow types restored as arrow backed pandas dtypes
+TYPES = {pyarrow.string():       pandas.StringDtype("pyarrow"),
+         pyarrow.large_string(): pandas.StringDtype("pyarrow")}
+
+# Tstat logs: one header line and space separated fields; empty fields are
+# missing and text is never read as a timestamp, as with pandas.read_csv
+PARSE = pyarrow.csv.ParseOptions(delimiter=" ")
+READ  = pyarrow.csv.ReadOptions(use_threads=True)
+
+
+def cache_path(path: str) -> str:
+    return os.path.join(CACHE, os.path.normpath(path) + ".arrow")
+
+def file_signature(size: int, mtime_ns: int, document: Document | None) -> bytes:
+    return f"{size}:{mtime_ns}:{schema_tag(document)}".encode()
+
+def source_signature(path: str, document: Document | None) -> bytes:
+    stat = os.stat(path)
+    return file_signature(stat.st_size, stat.st_mtime_ns, document)
+
+def project(table: pyarrow.Table, columns: list[str] | None) -> pyarrow.Table:
+    # the requested columns the table has, in the requested order
+    if columns is None:
+        return table
+    names = set(table.schema.names)
+    return table.select([column for column in columns if column in names])
+
+def overlapping(data: pandas.DataFrame, window: tuple[float, float] | None) -> pandas.DataFrame:
+    # rows overlapping the window (ms), bounds included
+    if window is None or "ts" not in data.columns or "te" not in data.columns:
+        return data
+    return data[(data["te"] >= window[0]) & (data["ts"] <= window[1])]
+
+def parse_log(path: str, document: Document | None) -> pandas.DataFrame:
+    convert = pyarrow.csv.ConvertOptions(column_types={column: pyarrow.string() for column in text_columns(document)},
+                                         strings_can_be_null=True, timestamp_parsers=[])
+    table = pyarrow.csv.read_csv(path, read_options=READ, parse_options=PARSE, convert_options=convert)
+    data  = table.to_pandas(split_blocks=True, self_destruct=True)
+    if document in SORTED:
+        # ties keep the order of the log
+        data = data.sort_values("ts", kind="stable", ignore_index=True)
+    return classify(apply_schema(data, document), document)
+
+def select_rows(table: pyarrow.Table, rows: numpy.ndarray, window: tuple[float, float],
+                columns: list[str] | None) -> pandas.DataFrame:
+    # rows of the table overlapping the window, indexed by their position in the log
+    keep = (table["te"].to_numpy() >= window[0]) & (table["ts"].to_numpy() <= window[1])
+    data = project(table, columns).to_pandas(types_mapper=TYPES.get)
+    data.index = pandas.Index(rows)
+    return data[keep]
+
+def read_cache(path: str, signature: bytes, columns: list[str] | None = None,
+               window: tuple[float, float] | None = None) -> pandas.DataFrame | None:
+    cache = cache_path(path)
+    if not os.path.exists(cache):
+        return None
+    try:
+        with pyarrow.memory_map(cache) as source:
+            reader = pyarrow.ipc.open_file(source)
+
+            # the cached copy is stale if it was built from another version of the log
+            metadata = reader.schema.metadata or {}
+            if metadata.get(SOURCE_KEY) != signature:
+                return None
+            if window is None or not {"ts", "te"} <= set(reader.schema.names):
+                return project(reader.read_all(), columns).to_pandas(types_mapper=TYPES.get)
+            if INDEX_KEY not in metadata:
+                table = reader.read_all()
+                return select_rows(table, numpy.arange(table.num_rows), window, columns)
+
+            # only the batches overlapping the window are mapped; one at least,
+            # its dictionaries give the categories of an empty frame
+            index   = json.loads(metadata[INDEX_KEY])
+            chosen  = [i for i, (ts, te, _) in enumerate(index) if te >= window[0] and ts <= window[1]] or [0]
+            batches = [reader.get_batch(i) for i in chosen]
+            rows    = numpy.concatenate([numpy.arange(index[i][2], index[i][2] + batch.num_rows)
+                                         for i, batch in zip(chosen, batches)] + [numpy.empty(0, dtype="int64")])
+            return select_rows(pyarrow.Table.from_batches(batches, schema=reader.schema), rows, window, columns)
+    except (OSError, pyarrow.ArrowException):
+        return None
+
+def write_cache(path: str, data: pandas.DataFrame, signature: bytes, document: Document | None = None):
+    cache = cache_path(path)
+    # arrow types alone restore the frame; pandas metadata would only slow
+    # down the conversion of a subset of the columns
+    table = pyarrow.Table.from_pandas(data, preserve_index=False)
+    metadata = {SOURCE_KEY: signature}
+
+    # sorted logs are written in batches, indexed by time
+    batches = table.to_batches(max_chunksize=BATCH)
+    if document in SORTED and len(table):
+        starts = numpy.cumsum([0] + [batch.num_rows for batch in batches[:-1]])
+        metadata[INDEX_KEY] = json.dumps([[pyarrow.compute.min(batch["ts"]).as_py(),
+                                           pyarrow.compute.max(batch["te"]).as_py(), int(start)]
+                                          for batch, start in zip(batches, starts)])
+    table = table.replace_schema_metadata(metadata)
+
+    # write to a temporary file of its own first, so that concurrent readers
+    # never see a partially written cache file, nor writers share one
+    temp = None
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        handle, temp = tempfile.mkstemp(dir=os.path.dirname(cache), prefix=os.path.basename(cache), suffix=".tmp")
+        os.close(handle)
+        with pyarrow.ipc.new_file(temp, table.schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+        os.replace(temp, cache)
+    except OSError:
+        # the cache is an optimization, a read-only checkout still works
+        if temp is not None and os.path.exists(temp):
+            os.remove(temp)
+
+def read_log(path: str, document: Document | None = None, columns: list[str] | None = None,
+             window: tuple[float, float] | None = None) -> pandas.DataFrame | None:
+    # columns of the log to read, all of them if None, and only the rows
+    # overlapping the window (ms) if any
+    if not os.path.exists(path):
+        return None
+
+    signature = source_signature(path, document)
+    with phase("cache read"):
+        data = read_cache(path, signature, columns, window)
+    count("arrow cache", misses=int(data is None))
+    if data is None:
+        # the cached copy holds every row and column, for the readers to come
+        with phase("parse"):
+            data = parse_log(path, document)
+        with phase("cache write"):
+            write_cache(path, data, signature, document)
+        data = overlapping(data, window)
+        if columns is not None:
+            data = data[[column for column in columns if column in data.columns]]
+    return data
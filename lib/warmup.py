@@ -0,0 +1,66 @@
+import os
+import time
+import threading
+import importlib
+import streamlit
+import streamlit.logger
+
+# Cache warm-up
+# Opt-in (TSTAT_WARMUP=1): the first run of the app after the server starts
+# loads, in a background thread, what the first visitor of every page would
+# wait for: the section modules and the libraries they import, the catalog,
+# the samples Misurazioni opens with (unless its charts are in the figure
+# store) and the logs of the experiment Ricostruzione Flussi opens with.
+# Everything lands in the caches shared by the sessions of the process, the
+# visitor starting the warm-up does not wait for it. This module imports
+# nothing heavy, the warm-up does.
+
+# set to warm the caches up when the server starts
+ENABLED = os.environ.get("TSTAT_WARMUP", "") not in ("", "0")
+
+# section modules, as the pages import them
+SECTIONS = ["lib.dazn.__fst_section", "lib.dazn.__snd_section", "lib.dazn.__trd_section"]
+
+SERVER = "dazn"
+
+logger = streamlit.logger.get_logger(__name__)
+
+
+def warm_up():
+    start = time.perf_counter()
+    for name in SECTIONS:
+        importlib.import_module(name)
+
+    from lib.generic import Protocol
+    from lib.catalog import load_catalog
+    from lib.figures import has_figure
+    from lib.memory import prefetching
+    from lib.experiment import DOCUMENTS
+    from lib.experiment import open_experiment
+    from lib.dazn.__trd_section import DEFAULT
+    from lib.dazn.__trd_section import chart_keys
+    from lib.dazn.__trd_section import load_samples
+
+    catalog = load_catalog(SERVER)
+    for protocol in [Protocol.TCP, Protocol.UDP]:
+        if not all(has_figure(key) for key in chart_keys(DEFAULT, protocol).values()):
+            load_samples(step=DEFAULT, protocol=protocol)
+
+    # the first test of the first rate, as selected when the page opens
+    rates = catalog.rates()
+    tests = catalog.tests(rates[0]) if rates else []
+    if tests:
+        with prefetching():
+            experiment = open_experiment(SERVER, rates[0], tests[0], catalog.stamp(rate=rates[0], test=tests[0]))
+            for document in DOCUMENTS:
+                experiment.frame(document)
+    logger.info(f"caches warmed up in {time.perf_counter() - start:.1f} s")
+
+@streamlit.cache_resource(show_spinner=False)
+def start() -> threading.Thread | None:
+    # once per server process, the thread is returned for whoever waits for it
+    if not ENABLED:
+        return None
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -1,8 +1,13 @@
 import streamlit
 
+from lib import warmup
+
 # Impostazioni della pagina
 streamlit.set_page_config(page_title="Benvenuto - Ricerca QoE", layout="centered")
 
+# Riscaldamento delle cache all'avvio del server (opzionale, TSTAT_WARMUP=1)
+warmup.start()
+
 # Titolo della pagina
 streamlit.title("Progettazione ed ingegnerizzazione di un sistema per l'analisi passiva della QoE da tracce Tstat")
 
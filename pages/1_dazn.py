@@ -1,9 +1,9 @@
 import os
+import importlib
 import streamlit
 
-from lib.dazn import __fst_section
-from lib.dazn import __snd_section
-from lib.dazn import __trd_section
+from lib import profiler
+from lib import warmup
 
 SERVER = "dazn"
 
@@ -15,24 +15,50 @@ def main():
     TRD_CHOICE = "Profilazione CNAMEs"
     FRT_CHOICE = "Misurazioni"
 
+    # section module of every page, imported (along with pandas, numpy and
+    # plotly) only once the page is chosen
+    sections = {SND_CHOICE: "lib.dazn.__fst_section",
+                TRD_CHOICE: "lib.dazn.__snd_section",
+                FRT_CHOICE: "lib.dazn.__trd_section"}
+
     # config page
     streamlit.set_page_config(layout="wide")
 
+    # once per server process, if enabled
+    warmup.start()
+
     with streamlit.sidebar:
         page = streamlit.radio("Seleziona pagina", 
                                options=[FST_CHOICE, SND_CHOICE, 
                                         TRD_CHOICE, FRT_CHOICE])
-        
-    if page == FST_CHOICE:
-        streamlit.html(os.path.join("www", SERVER, "0.html"))
-        streamlit.html(os.path.join("www", SERVER, "1.html"))
-    if page == SND_CHOICE:
-        __fst_section.__render()
-    if page == TRD_CHOICE:
-        __snd_section.__render()
-    if page == FRT_CHOICE:
-        __trd_section.__render()
-        
+
+        # opt-in timing of the rerun, shown below in the sidebar
+        profiling = streamlit.toggle("Profilazione", value=False, key=profiler.ENABLED)
+        save = streamlit.checkbox(f"Salva in {profiler.PROFILE}", value=False, disabled=not profiling,
+                                  key=profiler.SAVE)
+
+    profiler.start(page=page, enabled=profiling)
+    try:
+        with profiler.section(page):
+            if page == FST_CHOICE:
+                streamlit.html(os.path.join("www", SERVER, "0.html"))
+                streamlit.html(os.path.join("www", SERVER, "1.html"))
+            if page in sections:
+                with profiler.phase("import"):
+                    section = importlib.import_module(sections[page])
+                section.__render()
+    finally:
+        # always, the fragments rerunning alone must not find the profile of the page
+        profiler.finish(path=profiler.PROFILE if save else None)
+
+    if profiling:
+        # shared by every session, counted since the process started;
+        # imported here, it needs pandas
+        from lib import memory
+        with streamlit.sidebar:
+            streamlit.caption(f"#### Memoria ({memory.SHARED.size / 2 ** 20:.0f} di {memory.BUDGET} MiB)")
+            streamlit.dataframe(memory.SHARED.stats(), use_container_width=True, hide_index=True)
+
 
     # streamlit.html(os.path.join("www", SERVER, "3.html"))
 